@@ -0,0 +1,114 @@
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import time
+
+from cache import read_table
+from dates import date_years
+
+# Dish columns the dump precomputes from MenuItem -> MenuPage -> Menu
+AGGREGATE_COLUMNS = ['menus_appeared', 'times_appeared', 'first_appeared', 'last_appeared', 'lowest_price', 'highest_price']
+# Prices are compared to the cent
+PRICE_TOLERANCE = 0.005
+SAMPLE_IDS = 10
+
+
+def recompute_aggregates(items, pages, menus):
+    # Recompute every Dish aggregate in one join and one group-by:
+    # items has dish_id, menu_page_id and price, pages id and menu_id, menus id
+    # and date. Rows whose page or menu is missing still count as an appearance
+    pages = pages.drop_duplicates('id').rename(columns={'id': 'menu_page_id'})
+    menus = pd.DataFrame({'menu_id': menus['id'], 'year': date_years(menus['date'])}).drop_duplicates('menu_id')
+    joined = items.merge(pages, on='menu_page_id', how='left').merge(menus, on='menu_id', how='left')
+    return joined.groupby('dish_id').agg(
+        menus_appeared=('menu_id', 'nunique'),
+        times_appeared=('dish_id', 'size'),
+        first_appeared=('year', 'min'),
+        last_appeared=('year', 'max'),
+        lowest_price=('price', 'min'),
+        highest_price=('price', 'max'),
+    )
+
+
+def check_aggregates(dishes, recomputed, repair=False):
+    # Compare the stored aggregates of dishes with recomputed ones, per column:
+    # how many dishes could be checked, how many differ and a few of their ids.
+    # A dish without menu items appeared 0 times, its years and prices are unknown
+    # and left unchecked. With repair, mismatching values are overwritten in place
+    expected = recomputed.reindex(dishes['id'].to_numpy())
+    expected[['menus_appeared', 'times_appeared']] = expected[['menus_appeared', 'times_appeared']].fillna(0)
+    ids = dishes['id'].to_numpy()
+    report = {}
+    for col in AGGREGATE_COLUMNS:
+        if col not in dishes.columns:
+            continue
+        stored = dishes[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        values = expected[col].to_numpy(dtype=np.float64)
+        checked = ~np.isnan(values)
+        if col.endswith('_price'):
+            same = np.isclose(stored, values, rtol=0, atol=PRICE_TOLERANCE)
+        else:
+            same = stored == values
+        mismatch = checked & ~same
+        report[col] = {
+            'checked': int(checked.sum()),
+            'mismatched': int(mismatch.sum()),
+            'sample_ids': ids[mismatch][:SAMPLE_IDS].tolist(),
+        }
+        if repair and mismatch.any():
+            dishes.loc[mismatch, col] = pd.array(values[mismatch]).astype(dishes[col].dtype)
+    return report
+
+
+def merge_reports(reports):
+    # Sum the check_aggregates reports of consecutive chunks of the Dish table
+    merged = {}
+    for report in reports:
+        for col, res in report.items():
+            total = merged.setdefault(col, {'checked': 0, 'mismatched': 0, 'sample_ids': []})
+            total['checked'] += res['checked']
+            total['mismatched'] += res['mismatched']
+            total['sample_ids'] = (total['sample_ids'] + res['sample_ids'])[:SAMPLE_IDS]
+    return merged
+
+
+def load_recomputed(folder, prefix='', use_cache=True):
+    # Recomputed aggregates from {prefix}MenuItem/MenuPage/Menu.csv in folder,
+    # reading only the columns the join needs
+    path = lambda table: os.path.join(folder, f'{prefix}{table}.csv')
+    items = read_table(path('MenuItem'), columns=['dish_id', 'menu_page_id', 'price'], use_cache=use_cache)
+    pages = read_table(path('MenuPage'), columns=['id', 'menu_id'], use_cache=use_cache)
+    menus = read_table(path('Menu'), columns=['id', 'date'], use_cache=use_cache)
+    return recompute_aggregates(items, pages, menus)
+
+
+def print_report(report):
+    for col, res in report.items():
+        print(f"{col}: {res['mismatched']}/{res['checked']} mismatched" + (f", e.g. dish ids {res['sample_ids']}" if res['mismatched'] else ''))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='recompute the Dish aggregate columns from the menu items')
+    parser.add_argument('-d', '--dir', help='path to the cleaned dataset folder', type=str, default='../data/NYPL-menus-clean')
+    parser.add_argument('--prefix', help='file name prefix of the tables', type=str, default='cleaned_')
+    parser.add_argument('-o', '--output', help='path of the json mismatch report', type=str, default='aggregates_report.json')
+    parser.add_argument('--repair', help='overwrite mismatching values in the Dish csv', action='store_true')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    print('Configs =', args)
+    startTime = time.perf_counter()
+    dish_path = os.path.join(args.dir, f'{args.prefix}Dish.csv')
+    # --repair overwrites the csv, a parquet copy of it would be stale straight away
+    dishes = read_table(dish_path, use_cache=not args.repair)
+    report = check_aggregates(dishes, load_recomputed(args.dir, args.prefix), args.repair)
+    if args.repair:
+        dishes.to_csv(dish_path, index=False)
+    print_report(report)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved aggregate report to {args.output} ({time.perf_counter() - startTime:.2f}s)")
@@ -0,0 +1,206 @@
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import time
+
+# Row counts of the real dump, scale 1.0 generates this many rows
+BASE_ROWS = {
+    'Dish': 423397,
+    'Menu': 17545,
+    'MenuPage': 66937,
+    'MenuItem': 1332726,
+}
+# Fraction of rows made dirty in each way the tests and the cleaner look for
+DEFAULT_RATES = {
+    'zero_ids': 0.001,         # id (and menu_id / menu_page_id / dish_id) set to 0
+    'bad_dates': 0.05,         # Menu.date unparseable, partial or out of range
+    'high_price': 0.01,        # MenuItem.high_price below price
+    'orphans': 0.005,          # foreign key pointing past the parent table
+    'duplicate_uuids': 0.002,  # MenuPage.uuid copied from another page
+}
+# MenuItem rows are written in chunks of this many, so 10x stays in memory
+CHUNK_ROWS = 1000000
+
+WORDS = [
+    'coffee', 'tea', 'roast', 'beef', 'chicken', 'soup', 'salad', 'fried', 'boiled', 'potatoes',
+    'lobster', 'oysters', 'clam', 'chowder', 'steak', 'sirloin', 'pie', 'apple', 'ice', 'cream',
+    'cheese', 'ham', 'eggs', 'bacon', 'toast', 'lamb', 'mutton', 'veal', 'cutlet', 'sauce',
+    'green', 'peas', 'corn', 'rice', 'pudding', 'fresh', 'broiled', 'mackerel', 'salmon', 'trout',
+    'consomme', 'julienne', 'punch', 'claret', 'sherry', 'wine', 'champagne', 'milk', 'cocoa', 'chocolate',
+]
+BAD_DATES = ['1900-02-30', '0190-03-04', '2928-12-31', '1900-1', '1899', 'n.d.', None]
+CURRENCIES = [('Dollars', '$'), ('Francs', 'FF'), ('UK Pounds', '£'), (None, None)]
+
+
+def table_columns(table):
+    # Column names of the table in the model order, the csv header of the dump
+    from tests import TABLE_MAP
+    return [col.name for col in TABLE_MAP[table].__table__.columns]
+
+
+def _dirty(rng, n, rate):
+    return rng.random(n) < rate
+
+
+def _ids(rng, n, rate):
+    ids = np.arange(1, n + 1)
+    ids[_dirty(rng, n, rate)] = 0
+    return ids
+
+
+def _refs(rng, n, parent_rows, rates):
+    # Foreign keys into 1..parent_rows, some orphaned past the end or zeroed
+    refs = rng.integers(1, parent_rows + 1, n)
+    orphan = _dirty(rng, n, rates['orphans'])
+    refs[orphan] = parent_rows + rng.integers(1, 1000, orphan.sum())
+    refs[_dirty(rng, n, rates['zero_ids'])] = 0
+    return refs
+
+
+def _names(rng, n):
+    words = np.array(WORDS, dtype=object)
+    names = words[rng.integers(0, len(WORDS), n)]
+    for extra in range(2):
+        more = rng.random(n) < 0.5 / (extra + 1)
+        names[more] = names[more] + ' ' + words[rng.integers(0, len(WORDS), more.sum())]
+    # the dump's casing and trailing space variants of the same dish
+    title = rng.random(n) < 0.2
+    names[title] = [name.title() for name in names[title]]
+    names[rng.random(n) < 0.02] += ' '
+    return names
+
+
+def _timestamps(seconds):
+    return pd.Series(pd.to_datetime(seconds, unit='s')).dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy(dtype=object) + ' UTC'
+
+
+def gen_dish(rng, n, rates):
+    first = rng.integers(1851, 2008, n)
+    last = np.minimum(first + rng.integers(0, 50, n), 2012)
+    # unknown years are stored as 0 in the dump
+    first[rng.random(n) < 0.05] = 0
+    last[rng.random(n) < 0.05] = 0
+    lowest = np.round(rng.gamma(1.5, 2.0, n), 2)
+    return pd.DataFrame({
+        'id': _ids(rng, n, rates['zero_ids']),
+        'name': _names(rng, n),
+        'description': None,
+        'menus_appeared': rng.integers(1, 100, n),
+        'times_appeared': rng.integers(1, 100, n),
+        'first_appeared': first,
+        'last_appeared': last,
+        'lowest_price': np.where(rng.random(n) < 0.3, np.nan, lowest),
+        'highest_price': np.where(rng.random(n) < 0.3, np.nan, lowest + np.round(rng.gamma(1.0, 1.0, n), 2)),
+    })
+
+
+def gen_menu(rng, n, rates):
+    days = rng.integers(0, (2012 - 1851) * 365, n)
+    dates = (np.datetime64('1851-01-01') + days.astype('timedelta64[D]')).astype(str).astype(object)
+    bad = _dirty(rng, n, rates['bad_dates'])
+    dates[bad] = np.array(BAD_DATES, dtype=object)[rng.integers(0, len(BAD_DATES), bad.sum())]
+    currency = rng.integers(0, len(CURRENCIES), n)
+    return pd.DataFrame({
+        'id': _ids(rng, n, rates['zero_ids']),
+        'name': np.where(rng.random(n) < 0.7, None, 'Hotel Astor'),
+        'sponsor': 'Waldorf Astoria',
+        'event': rng.choice(['BREAKFAST', 'LUNCH', 'DINNER', None], n),
+        'venue': rng.choice(['COMMERCIAL', 'SOC;', None], n),
+        'place': 'NEW YORK, NY',
+        'physical_description': 'CARD; 4.75X7.5;',
+        'occasion': None,
+        'notes': rng.choice([None, 'Menu in French, "prix fixe"'], n),
+        'call_number': [f'{1900 + i % 100}-{i}' for i in range(n)],
+        'keywords': None,
+        'language': rng.choice([None, 'English', 'French'], n),
+        'date': dates,
+        'location': rng.choice(['Hotel Astor', 'Delmonico\'s', 'Waldorf Astoria'], n),
+        'location_type': None,
+        'currency': [CURRENCIES[i][0] for i in currency],
+        'currency_symbol': [CURRENCIES[i][1] for i in currency],
+        'status': rng.choice(['complete', 'under review'], n),
+        'page_count': rng.integers(1, 12, n),
+        'dish_count': rng.integers(0, 200, n),
+    })
+
+
+def gen_menu_page(rng, n, menu_rows, rates):
+    uuids = np.array([f'{i:08x}-0000-4000-8000-{i:012x}' for i in range(n)], dtype=object)
+    dup = np.flatnonzero(_dirty(rng, n, rates['duplicate_uuids']))
+    uuids[dup] = uuids[rng.integers(0, n, len(dup))]
+    menu_id = _refs(rng, n, menu_rows, rates)
+    # pages of a menu are numbered 1, 2, ... in id order
+    page_number = pd.Series(menu_id).groupby(menu_id).cumcount().to_numpy() + 1
+    return pd.DataFrame({
+        'id': _ids(rng, n, rates['zero_ids']),
+        'menu_id': menu_id,
+        'page_number': np.where(rng.random(n) < 0.02, np.nan, page_number),
+        'image_id': rng.integers(1000, 5000000, n).astype(str),
+        'full_height': rng.integers(500, 8000, n),
+        'full_width': rng.integers(500, 6000, n),
+        'uuid': uuids,
+    })
+
+
+def gen_menu_item(rng, start, n, page_rows, dish_rows, rates):
+    price = np.where(rng.random(n) < 0.3, np.nan, np.round(rng.gamma(1.5, 2.0, n), 2))
+    high_price = np.where(rng.random(n) < 0.9, np.nan, price + np.round(rng.gamma(1.0, 1.0, n), 2))
+    low = _dirty(rng, n, rates['high_price']) & ~np.isnan(price)
+    high_price[low] = np.round(price[low] / 2, 2)
+    created = rng.integers(1301270400, 1420070400, n)
+    ids = np.arange(start + 1, start + n + 1)
+    ids[_dirty(rng, n, rates['zero_ids'])] = 0
+    return pd.DataFrame({
+        'id': ids,
+        'menu_page_id': _refs(rng, n, page_rows, rates),
+        'price': price,
+        'high_price': high_price,
+        'dish_id': _refs(rng, n, dish_rows, rates),
+        'created_at': _timestamps(created),
+        'updated_at': _timestamps(created + rng.integers(0, 86400 * 30, n)),
+        'xpos': np.round(rng.random(n), 6),
+        'ypos': np.round(rng.random(n), 6),
+    })
+
+
+def generate(out_dir, scale=1.0, seed=0, rates=None):
+    # Write Dish, Menu, MenuPage and MenuItem csv files shaped like the dump into
+    # out_dir, the same seed, scale and rates always give the same files
+    rates = {**DEFAULT_RATES, **(rates or {})}
+    rows = {table: max(1, int(n * scale)) for table, n in BASE_ROWS.items()}
+    os.makedirs(out_dir, exist_ok=True)
+    rngs = dict(zip(BASE_ROWS, (np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(len(BASE_ROWS)))))
+    path = lambda table: os.path.join(out_dir, f'{table}.csv')
+
+    frames = {
+        'Dish': gen_dish(rngs['Dish'], rows['Dish'], rates),
+        'Menu': gen_menu(rngs['Menu'], rows['Menu'], rates),
+        'MenuPage': gen_menu_page(rngs['MenuPage'], rows['MenuPage'], rows['Menu'], rates),
+    }
+    for table, df in frames.items():
+        df[table_columns(table)].to_csv(path(table), index=False)
+    columns = table_columns('MenuItem')
+    for start in range(0, rows['MenuItem'], CHUNK_ROWS):
+        n = min(CHUNK_ROWS, rows['MenuItem'] - start)
+        df = gen_menu_item(rngs['MenuItem'], start, n, rows['MenuPage'], rows['Dish'], rates)
+        df[columns].to_csv(path('MenuItem'), index=False, mode='a' if start else 'w', header=not start)
+    return rows
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='generate a synthetic NYPL menus dataset')
+    parser.add_argument('-o', '--outdir', help='path to the dataset folder to write', type=str, default='../data/bench')
+    parser.add_argument('-s', '--scale', help='size relative to the real dump, e.g. 0.1 to 10', type=float, default=1.0)
+    parser.add_argument('--seed', help='random seed', type=int, default=0)
+    parser.add_argument('--rates', help=f'json object overriding the dirtiness rates {DEFAULT_RATES}', type=json.loads, default=None)
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    print('Configs =', args)
+    startTime = time.perf_counter()
+    rows = generate(args.outdir, args.scale, args.seed, args.rates)
+    print(f"Generated {rows} rows in {args.outdir} ({time.perf_counter() - startTime:.2f}s)")
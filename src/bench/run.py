@@ -0,0 +1,199 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+import pandas as pd
+
+from bench.generate import DEFAULT_RATES, generate
+
+TABLES = ['Dish', 'Menu', 'MenuPage', 'MenuItem']
+CHUNKSIZE = 500000
+
+
+# Every stage takes the run config and returns the number of rows it processed,
+# it reads the outputs of the stages before it from the work folder
+def stage_generate(config):
+    rows = generate(config['data'], config['scale'], config['seed'], config['rates'])
+    return sum(rows.values())
+
+
+def stage_validate(config):
+    from validate import FRAME_GROUPS, FrameTables, run_class
+    os.makedirs(config['test_output'], exist_ok=True)
+    tables = FrameTables(config['data'])
+    for classes in FRAME_GROUPS.values():
+        for class_name, checks in classes.items():
+            run_class(tables, class_name, checks, config['test_output'])
+    return _rows(config['data'])
+
+
+def stage_profile(config):
+    from profile import profile_file
+    return sum(profile_file(f, CHUNKSIZE)[0]['rows'] for f in _csv_files(config['data']))
+
+
+def stage_clamp_year(config):
+    from cache import read_table
+    from dates import clamp_years
+    dates = read_table(os.path.join(config['data'], 'Menu.csv'), columns=['date'])['date']
+    clamp_years(dates)
+    return len(dates)
+
+
+def stage_clean(config):
+    from clean import clean_table
+    os.makedirs(config['clean'], exist_ok=True)
+    return sum(
+        clean_table(f'{table}.csv', config['data'], config['clean'], config['test_output'], config['chunksize'])
+        for table in TABLES
+    )
+
+
+def stage_get_change(config):
+    from report_change import get_change_files
+    rows = 0
+    for table in TABLES:
+        dirty_f = os.path.join(config['data'], f'{table}.csv')
+        get_change_files(dirty_f, os.path.join(config['clean'], f'cleaned_{table}.csv'), CHUNKSIZE)
+        rows += _rows(dirty_f)
+    return rows
+
+
+def stage_insert(config):
+    # insert_data into a fresh SQLite file, the benchmark does not need the MySQL server
+    from sqlalchemy import create_engine
+    from test import insert_data
+    from tests import Base
+    db_path = os.path.join(config['work'], 'bench.db')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    engine = create_engine(f'sqlite:///{db_path}')
+    Base.metadata.create_all(engine)
+    # rejected rows are logged to a file, not to the benchmark output
+    logger = logging.getLogger('bench.insert')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.FileHandler(os.path.join(config['work'], 'insert.log')))
+    return sum(insert_data(f, engine, config['work'], logger)[0] for f in _csv_files(config['data']))
+
+
+STAGES = {
+    'generate': stage_generate,
+    'validate': stage_validate,
+    'profile': stage_profile,
+    'clamp_year': stage_clamp_year,
+    'clean': stage_clean,
+    'get_change': stage_get_change,
+    'insert': stage_insert,
+}
+
+
+def _csv_files(folder):
+    return sorted(glob.glob(os.path.join(folder, '*.csv')))
+
+
+def _rows(path):
+    from cache import read_table
+    files = _csv_files(path) if os.path.isdir(path) else [path]
+    return sum(len(read_table(f, columns=['id'])) for f in files)
+
+
+def measure(stage, config):
+    # Runs in a fresh child process, so ru_maxrss is the peak of this stage alone
+    startTime = time.perf_counter()
+    rows = STAGES[stage](config)
+    seconds = time.perf_counter() - startTime
+    return {
+        'seconds': round(seconds, 4),
+        'rows': rows,
+        'rows_per_sec': round(rows / seconds, 1) if seconds else None,
+        # Linux reports ru_maxrss in KiB
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_stages(stages, config):
+    results = {}
+    for stage in stages:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            results[stage] = executor.submit(measure, stage, config).result()
+        res = results[stage]
+        print(f"{stage}: {res['seconds']:.2f}s, {res['rows']} rows, {res['rows_per_sec']} rows/s, peak RSS {res['peak_rss_mb']} MB", flush=True)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path):
+    # Print the per stage change between two result files
+    with open(old_path) as f:
+        old = json.load(f)['stages']
+    with open(new_path) as f:
+        new = json.load(f)['stages']
+    print(f"{'stage':<12}{'old s':>10}{'new s':>10}{'speedup':>10}{'old MB':>10}{'new MB':>10}")
+    for stage in new:
+        if stage not in old:
+            continue
+        a, b = old[stage], new[stage]
+        print(f"{stage:<12}{a['seconds']:>10.2f}{b['seconds']:>10.2f}{a['seconds'] / b['seconds']:>9.2f}x{a['peak_rss_mb']:>10}{b['peak_rss_mb']:>10}")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='benchmark the pipeline stages on a synthetic dataset')
+    parser.add_argument('-w', '--workdir', help='folder for the generated data and stage outputs', type=str, default='../data/bench')
+    parser.add_argument('-o', '--output', help='path of the json results', type=str, default='bench_results.json')
+    parser.add_argument('-s', '--scale', help='size relative to the real dump, e.g. 0.1 to 10', type=float, default=0.1)
+    parser.add_argument('--seed', help='random seed of the generator', type=int, default=0)
+    parser.add_argument('--rates', help=f'json object overriding the dirtiness rates {DEFAULT_RATES}', type=json.loads, default=None)
+    parser.add_argument('-c', '--chunksize', help='clean in chunks of this many rows (default: whole tables)', type=int, default=None)
+    parser.add_argument('--stages', nargs='*', help=f'stages to run in order, options: {list(STAGES)}', default=list(STAGES))
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files instead of running')
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        print('Configs =', args)
+        config = {
+            'work': args.workdir,
+            'data': os.path.join(args.workdir, 'NYPL-menus'),
+            'test_output': os.path.join(args.workdir, 'test_output_dirty'),
+            'clean': os.path.join(args.workdir, 'NYPL-menus-clean'),
+            'scale': args.scale,
+            'seed': args.seed,
+            'rates': {**DEFAULT_RATES, **(args.rates or {})},
+            'chunksize': args.chunksize,
+        }
+        os.makedirs(args.workdir, exist_ok=True)
+        stages = run_stages([s for s in args.stages if s in STAGES], config)
+        results = {
+            'meta': {
+                'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'cpus': os.cpu_count(),
+                **{k: config[k] for k in ('scale', 'seed', 'rates', 'chunksize')},
+            },
+            'stages': stages,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved benchmark results to {args.output}")
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # no columnar cache, every load parses the csv
+    pa = pq = None
+
+# Typed parquet copies of the csv files live in NYPL_CACHE_DIR, or in a .cache
+# folder next to each csv. Set NYPL_NO_CACHE=1 to always parse the csv.
+CACHE_DIR = os.environ.get('NYPL_CACHE_DIR')
+NO_CACHE = os.environ.get('NYPL_NO_CACHE', '') not in ('', '0')
+# 3: the sha1 covers the whole csv, not its first and last MiB
+# 4: xpos/ypos back to float64
+# 5: the csv is parsed with the schema dtypes
+CACHE_VERSION = 5
+_HASH_BLOCK = 1 << 20
+_CONVERT_ROWS = 1 << 20
+# pandas dtype of every column of the NYPL tables, kept here rather than on the
+# SQLAlchemy models so loading a csv never imports the database layer; the models in
+# tests/test_base.py take their info['dtype'] from this map. Nullable int32 for
+# Integer (ids and counts fit), float64 for Float, string for text and the raw
+# "... UTC" timestamps, category for the few-valued Menu text columns
+TABLE_DTYPES = {
+    'Dish': {
+        'id': 'Int32', 'name': 'string', 'description': 'string', 'menus_appeared': 'Int32',
+        'times_appeared': 'Int32', 'first_appeared': 'Int32', 'last_appeared': 'Int32',
+        'lowest_price': 'float64', 'highest_price': 'float64',
+    },
+    'Menu': {
+        'id': 'Int32', 'name': 'string', 'sponsor': 'string', 'event': 'string', 'venue': 'string',
+        'place': 'string', 'physical_description': 'string', 'occasion': 'string', 'notes': 'string',
+        'call_number': 'string', 'keywords': 'string', 'language': 'category', 'date': 'string',
+        'location': 'string', 'location_type': 'category', 'currency': 'category',
+        'currency_symbol': 'category', 'status': 'category', 'page_count': 'Int32', 'dish_count': 'Int32',
+    },
+    'MenuPage': {
+        'id': 'Int32', 'menu_id': 'Int32', 'page_number': 'Int32', 'image_id': 'string',
+        'full_height': 'Int32', 'full_width': 'Int32', 'uuid': 'string',
+    },
+    'MenuItem': {
+        'id': 'Int32', 'menu_page_id': 'Int32', 'price': 'float64', 'high_price': 'float64',
+        'dish_id': 'Int32', 'created_at': 'string', 'updated_at': 'string', 'xpos': 'float64',
+        'ypos': 'float64',
+    },
+}
+# Smallest parquet row group iter_table writes while streaming a csv
+_STREAM_GROUP_ROWS = 1 << 17
+
+
+def table_name(file_path):
+    # 'MenuItem.csv' and 'cleaned_MenuItem.csv' both map to the MenuItem model
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return name[len('cleaned_'):] if name.startswith('cleaned_') else name
+
+
+def table_dtypes(table):
+    # Compact pandas dtypes of the table's columns, {} for unknown tables
+    return dict(TABLE_DTYPES.get(table, {}))
+
+
+def csv_dtypes(table, numbers=True):
+    # read_csv dtype= of the table, so every chunk parses a column the same way instead
+    # of read_csv guessing per chunk. numbers=False leaves the numeric columns to the
+    # guess, for files whose numbers do not fit their dtype
+    return {
+        col: dtype for col, dtype in table_dtypes(table).items()
+        if numbers or dtype in ('string', 'category')
+    }
+
+
+def read_csv(file_path, usecols=None):
+    # pd.read_csv parsed with the table's dtypes; numbers that do not fit are guessed
+    # and then cast by apply_schema
+    table = table_name(file_path)
+    try:
+        return pd.read_csv(file_path, usecols=usecols, dtype=csv_dtypes(table))
+    except (TypeError, ValueError, OverflowError):
+        return apply_schema(pd.read_csv(file_path, usecols=usecols, dtype=csv_dtypes(table, numbers=False)), table)
+
+
+def read_csv_chunks(file_path, chunksize, usecols=None):
+    # Chunked read_csv. When a chunk has numbers that do not fit, the file is read
+    # again with guessed numbers from that chunk on
+    table = table_name(file_path)
+    chunks = 0
+    try:
+        for df in pd.read_csv(file_path, usecols=usecols, chunksize=chunksize, dtype=csv_dtypes(table)):
+            chunks += 1
+            yield df
+        return
+    except (TypeError, ValueError, OverflowError):
+        pass
+    reader = pd.read_csv(file_path, usecols=usecols, chunksize=chunksize, dtype=csv_dtypes(table, numbers=False))
+    for i, df in enumerate(reader):
+        if i >= chunks:
+            yield apply_schema(df, table)
+
+
+def apply_schema(df, table):
+    # Cast columns to the model dtypes, a column whose values do not fit keeps its inferred dtype
+    for col, dtype in table_dtypes(table).items():
+        if col in df.columns:
+            try:
+                df[col] = df[col].astype(dtype)
+            except (TypeError, ValueError, OverflowError):
+                pass
+    return df
+
+
+def memory_report(file_path):
+    # Memory of the table parsed by plain read_csv next to the compact dtypes read_table gives it
+    before = pd.read_csv(file_path).memory_usage(deep=True, index=False)
+    after = read_table(file_path).memory_usage(deep=True, index=False)
+    return pd.DataFrame({'read_csv': before, 'read_table': after.reindex(before.index)})
+
+
+def source_key(file_path):
+    # Identity of the csv: size, mtime and a hash of its whole content
+    stat = os.stat(file_path)
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b''):
+            sha1.update(block)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha1.hexdigest()}
+
+
+def cache_path(file_path, cache_dir=None):
+    file_path = os.path.abspath(file_path)
+    cache_dir = cache_dir or CACHE_DIR or os.path.join(os.path.dirname(file_path), '.cache')
+    digest = hashlib.sha1(file_path.encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f'{table_name(file_path)}-{digest}.parquet')
+
+
+def _is_fresh(file_path, meta_path):
+    if not os.path.isfile(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get('version') != CACHE_VERSION or meta.get('source') != os.path.abspath(file_path):
+        return False
+    stat = os.stat(file_path)
+    if meta['size'] != stat.st_size:
+        return False
+    if meta['mtime_ns'] == stat.st_mtime_ns:
+        return True
+    # touched, copied or edited in place: compare the hash of the whole content and
+    # remember the new mtime when it is unchanged
+    key = source_key(file_path)
+    if key['sha1'] != meta['sha1']:
+        return False
+    meta.update(key)
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return True
+
+
+def _convert(file_path, out_path, chunksize):
+    if chunksize is None:
+        read_csv(file_path).to_parquet(out_path, index=False)
+        return
+    writer = None
+    try:
+        for df in read_csv_chunks(file_path, chunksize):
+            if writer is None:
+                chunk = pa.Table.from_pandas(df, preserve_index=False)
+                writer = pq.ParquetWriter(out_path, chunk.schema)
+            else:
+                chunk = pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False)
+            writer.write_table(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def ensure_cache(file_path, cache_dir=None):
+    # Path of an up to date parquet copy of file_path, converting the csv if needed
+    path = cache_path(file_path, cache_dir)
+    meta_path = path + '.json'
+    if _is_fresh(file_path, meta_path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    key = source_key(file_path)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        _convert(file_path, tmp_path, _CONVERT_ROWS)
+    except (pa.ArrowException, TypeError, ValueError):
+        # a later chunk did not fit the types of the first one, convert in one piece
+        _convert(file_path, tmp_path, None)
+    os.replace(tmp_path, path)
+    _write_meta(file_path, meta_path, key)
+    return path
+
+
+def _write_meta(file_path, meta_path, key):
+    with open(meta_path, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'source': os.path.abspath(file_path), **key}, f)
+
+
+def _stream_convert(file_path, path, chunksize, columns=None):
+    # Yield the csv in chunks of chunksize rows while writing its parquet copy, so
+    # the first chunk does not wait for the whole file. The copy is only kept when
+    # every chunk went through and fitted the types of the first one
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    key = source_key(file_path)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    writer = None
+    pending = []  # chunks buffered into row groups of at least _STREAM_GROUP_ROWS rows
+    complete = False
+    try:
+        for df in read_csv_chunks(file_path, chunksize):
+            if pending is not None:
+                try:
+                    chunk = pa.Table.from_pandas(df, schema=writer.schema if writer else None, preserve_index=False)
+                    writer = writer or pq.ParquetWriter(tmp_path, chunk.schema)
+                    pending.append(chunk)
+                    if sum(len(c) for c in pending) >= _STREAM_GROUP_ROWS:
+                        writer.write_table(pa.concat_tables(pending))
+                        pending = []
+                except (pa.ArrowException, TypeError, ValueError):
+                    # ensure_cache converts the csv in one piece next time
+                    pending = None
+            yield df if columns is None else df[columns]
+        if pending is not None and writer is not None:
+            if pending:
+                writer.write_table(pa.concat_tables(pending))
+            complete = True
+    finally:
+        if writer is not None:
+            writer.close()
+        if complete:
+            os.replace(tmp_path, path)
+            _write_meta(file_path, path + '.json', key)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _filter(df, filters):
+    # Apply [(column, op, value), ...] row filters the way read_parquet does
+    ops = {'==': '__eq__', '!=': '__ne__', '<': '__lt__', '<=': '__le__', '>': '__gt__', '>=': '__ge__'}
+    for col, op, value in filters:
+        df = df[getattr(df[col], ops[op])(value).fillna(False)]
+    return df
+
+
+def read_table(file_path, columns=None, cache_dir=None, filters=None, use_cache=True):
+    # Load a NYPL csv through the parquet cache, only reading the requested
+    # columns and, with filters, only the matching rows. use_cache=False parses the
+    # csv, for files written by this run that a cache copy would not outlive
+    if NO_CACHE or pq is None or not use_cache:
+        if not filters:
+            return read_csv(file_path, usecols=columns)
+        df = _filter(read_csv(file_path), filters)
+        return df[columns] if columns is not None else df
+    return pd.read_parquet(ensure_cache(file_path, cache_dir), columns=columns, filters=filters)
+
+
+def row_count(file_path, cache_dir=None):
+    # Rows of the csv from its cached parquet metadata, None while there is no fresh cache
+    path = cache_path(file_path, cache_dir)
+    if NO_CACHE or pq is None or not _is_fresh(file_path, path + '.json'):
+        return None
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def iter_table(file_path, chunksize, columns=None, cache_dir=None, use_cache=True):
+    # Chunked read_table, yields DataFrames of at most chunksize rows. Without a
+    # fresh cache the csv itself is streamed and the cache written along the way
+    if NO_CACHE or pq is None or not use_cache:
+        yield from read_csv_chunks(file_path, chunksize, usecols=columns)
+        return
+    path = cache_path(file_path, cache_dir)
+    if not _is_fresh(file_path, path + '.json'):
+        yield from _stream_convert(file_path, path, chunksize, columns)
+        return
+    parquet = pq.ParquetFile(path)
+    start = 0
+    for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+        df = batch.to_pandas()
+        df.index = pd.RangeIndex(start, start + len(df))
+        start += len(df)
+        yield df
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='build the parquet cache and report the memory saved by the compact dtypes')
+    parser.add_argument('files', nargs='+', help='csv files to load')
+    for file_path in parser.parse_args().files:
+        report = memory_report(file_path)
+        total = report.sum()
+        print(f"{file_path}: {total['read_csv'] / 2**20:.1f} MB -> {total['read_table'] / 2**20:.1f} MB")
+        print((report / 2**20).round(2).to_string(), '\n')
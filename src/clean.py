@@ -4,15 +4,33 @@
 # @out NYPL-menus-clean/*.csv @AS output_files
 import argparse
 import json
+import numpy as np
 import os
 import pandas as pd
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
+from cache import iter_table, read_table
+from dates import clamp_years, clamp_year_values
+from integrity import FOREIGN_KEYS, semi_join, sorted_ids
+import aggregates
+import failed_ids as fi
+import manifest as mf
+import tracing
+
+# Bump whenever clean_data changes its output, so --incremental rebuilds everything
+RULES_VERSION = 2
+# Row block size of --incremental runs without -c
+BLOCK_ROWS = 100000
+
 # @begin load_data
 # @in file_path
 # @out df
 def load_data(file_path):
-    return pd.read_csv(file_path)
+    return read_table(file_path)
 # @end load_data
 
 def try_parse_date(dt, date_str, format):
@@ -24,6 +42,7 @@ def try_parse_date(dt, date_str, format):
     else:
         return dt
 
+# scalar reference for dates.clamp_years, which clean_data uses
 def clamp_year(date_str):
     date_str = str(date_str)
 
@@ -38,67 +57,148 @@ def clamp_year(date_str):
     dt = dt.replace(year=min(2025, max(1500, dt.year)))
     return dt.strftime('%Y-%m-%d')
 
+class SeenIds:
+    # Compact record of the ids already emitted across chunks: a flag array indexed
+    # by id, grown to at most DENSE_FACTOR flags per row seen so far, a sorted array
+    # for the ids past it and a set for the rare ids that cannot index anything
+    DENSE_FACTOR = 4
+
+    def __init__(self, size=1 << 20):
+        self.flags = np.zeros(size, dtype=bool)
+        self.sparse = np.empty(0, dtype=np.int64)
+        self.other = set()
+        self.rows = 0
+
+    def _grow(self, idx):
+        # Grow the flag array towards the largest id, within the cap
+        cap = max(len(self.flags), self.DENSE_FACTOR * self.rows)
+        idx = idx[idx < cap]
+        if (not len(idx) or idx.max() < len(self.flags)):
+            return
+        grown = np.zeros(min(cap, max(int(idx.max()) + 1, 2 * len(self.flags))), dtype=bool)
+        grown[:len(self.flags)] = self.flags
+        self.flags = grown
+        # sparse ids the array now covers move into it
+        moved = self.sparse < len(self.flags)
+        self.flags[self.sparse[moved]] = True
+        self.sparse = self.sparse[~moved]
+
+    def first_seen(self, ids):
+        # Mask of ids that are neither repeated within ids nor seen in earlier calls
+        ids = pd.Series(ids).reset_index(drop=True)
+        keep = ~ids.duplicated().to_numpy()
+        values = ids.to_numpy(dtype=float, na_value=np.nan)
+        self.rows += len(values)
+        indexable = (values >= 0) & (values % 1 == 0)
+        idx = values[indexable].astype(np.int64)
+        self._grow(idx)
+        dense = np.zeros(len(values), dtype=bool)
+        dense[indexable] = idx < len(self.flags)
+        idx = values[dense].astype(np.int64)
+        keep[dense] &= ~self.flags[idx]
+        self.flags[idx[keep[dense]]] = True
+        sparse = indexable & ~dense
+        if (sparse.any()):
+            keep[sparse] &= ~semi_join(values[sparse], self.sparse)
+            self.sparse = np.union1d(self.sparse, values[sparse & keep].astype(np.int64))
+        for i in np.flatnonzero(~indexable & keep):
+            key = None if np.isnan(values[i]) else values[i]
+            keep[i] = key not in self.other
+            self.other.add(key)
+        return keep
+
 # @begin clean_data
 # @in df
 # @in filename
-# @in failed_ids_files
+# @in failed_ids
 # @out cleaned_df
-def clean_data(df, filename, failed_ids_files):
+def clean_data(df, filename, failed_ids, seen_ids=None):
+    # failed_ids is the table's sorted array from failed_ids.load_index.
+    # Rows to drop are collected into a single mask so the frame is copied once.
+    # Every block below is a tracing.stage span, recorded when --trace is on
+    table = os.path.splitext(filename)[0]
+    keep = pd.Series(True, index=df.index)
     # @begin remove_zero_ids
     # @in df
     # @out df_1
-    if 'id' in df.columns:
-        df = df[df['id'] != 0]
-        df = df.drop_duplicates(subset=['id'])
+    with tracing.stage('remove_zero_ids', table, len(df)) as span:
+        if 'id' in df.columns:
+            keep &= (df['id'] != 0).fillna(True)
+            if seen_ids is None:
+                keep &= ~df['id'].duplicated()
+            else:
+                # streaming mode, duplicates may sit in an earlier chunk
+                keep[keep] = seen_ids.first_seen(df['id'][keep])
+        span.keep(keep)
     # @end remove_zero_ids
 
-    if filename.startswith("MenuPage") and 'menu_id' in df.columns:
-        df = df[df['menu_id'] != 0]
-    if filename.startswith("MenuItem"):
-        if 'menu_page_id' in df.columns:
-            df = df[df['menu_page_id'] != 0]
-        if 'dish_id' in df.columns:
-            df = df[df['dish_id'] != 0]
-
-    for failed_ids_file in failed_ids_files:
-        with open(failed_ids_file) as f:
-            failed_ids = json.load(f)
+    # @begin remove_failed_ids
+    # @in df_1
+    # @in failed_ids
+    # @out df_2
+    # starts from the rows remove_zero_ids kept, so only this stage's drops count
+    with tracing.stage('remove_failed_ids', table, int(keep.sum())) as span:
+        if filename.startswith("MenuPage") and 'menu_id' in df.columns:
+            keep &= (df['menu_id'] != 0).fillna(True)
+        if filename.startswith("MenuItem"):
+            if 'menu_page_id' in df.columns:
+                keep &= (df['menu_page_id'] != 0).fillna(True)
+            if 'dish_id' in df.columns:
+                keep &= (df['dish_id'] != 0).fillna(True)
         if 'id' in df.columns:
-            df = df[~df['id'].isin(failed_ids)]
+            keep &= fi.not_failed(df['id'], failed_ids)
+        df = df[keep]
+        span.keep(keep)
+    # @end remove_failed_ids
     
     # @begin clamp_high_price
-    # @in df_1
-    # @out df_2
-    if 'price' in df.columns and 'high_price' in df.columns:
-        df.loc[df['high_price'] < df['price'], 'high_price'] = df['price']
+    # @in df_2
+    # @out df_3
+    with tracing.stage('clamp_high_price', table, len(df)) as span:
+        if 'price' in df.columns and 'high_price' in df.columns:
+            mask = (df['high_price'] < df['price']).fillna(False)
+            df.loc[mask, 'high_price'] = df['price']
+            span.modified(mask)
     # @end clamp_high_price
     
     # @begin clamp_updated_at
-    # @in df_2
-    # @out df_3
-    if 'created_at' in df.columns and 'updated_at' in df.columns:
-        df.loc[df['created_at'] > df['updated_at'], 'updated_at'] = df['created_at']
+    # @in df_3
+    # @out df_4
+    with tracing.stage('clamp_updated_at', table, len(df)) as span:
+        if 'created_at' in df.columns and 'updated_at' in df.columns:
+            mask = (df['created_at'] > df['updated_at']).fillna(False)
+            df.loc[mask, 'updated_at'] = df['created_at']
+            span.modified(mask)
     # @end clamp_updated_at
     
     # @begin clamp_year
-    # @in df_3
-    # @out df_4
-    if 'date' in df.columns:
-        df['date'] = df['date'].apply(lambda x: clamp_year(x))
+    # @in df_4
+    # @out df_5
+    with tracing.stage('clamp_year', table, len(df)) as span:
+        if 'date' in df.columns:
+            before = df['date']
+            df['date'] = clamp_years(before)
+            span.changed(before, df['date'])
     # @end clamp_year
     
     # @begin clamp_first_appeared
-    # @in df_4
-    # @out df_5
-    if 'first_appeared' in df.columns:
-        df['first_appeared'] = df['first_appeared'].apply(lambda x: min(2025, max(x, 1500)))
+    # @in df_5
+    # @out df_6
+    with tracing.stage('clamp_first_appeared', table, len(df)) as span:
+        if 'first_appeared' in df.columns:
+            before = df['first_appeared']
+            df['first_appeared'] = clamp_year_values(before)
+            span.changed(before, df['first_appeared'])
     # @end clamp_first_appeared
     
     # @begin clamp_last_appeared
-    # @in df_5
+    # @in df_6
     # @out cleaned_df
-    if 'last_appeared' in df.columns:
-        df['last_appeared'] = df['last_appeared'].apply(lambda x: min(2025, max(x, 1500)))
+    with tracing.stage('clamp_last_appeared', table, len(df)) as span:
+        if 'last_appeared' in df.columns:
+            before = df['last_appeared']
+            df['last_appeared'] = clamp_year_values(before)
+            span.changed(before, df['last_appeared'])
     # @end clamp_last_appeared
     return df
 # @end clean_data
@@ -108,8 +208,8 @@ def clean_data(df, filename, failed_ids_files):
 # @in cleaned_df
 # @in output_path
 # @out output_files
-def save_data(df, output_path):
-    df.to_csv(output_path, index=False)
+def save_data(df, output_path, append=False):
+    df.to_csv(output_path, index=False, mode='a' if append else 'w', header=not append)
 # @end save_data
 
 # @begin get_parser
@@ -120,42 +220,343 @@ def get_parser():
     parser.add_argument('-i', '--inpdir', help='path to the dataset folder', type=str, default='../data/NYPL-menus')
     parser.add_argument('-o', '--outdir', help='path to the output directory', type=str, default='../data/NYPL-menus-clean')
     parser.add_argument('-t', '--testdir', help='path to the test results directory', type=str, default='../data/test_output_dirty')
+    parser.add_argument('-c', '--chunksize', help='stream each table in chunks of this many rows (default: load whole table)', type=int, default=None)
+    parser.add_argument('-w', '--workers', help='number of tables to clean in parallel processes', type=int, default=1)
+    parser.add_argument('--prune-orphans', help='drop rows whose menu_id, menu_page_id or dish_id has no cleaned parent row', action='store_true')
+    parser.add_argument('--dedup-dishes', help='merge near duplicate dish names and remap MenuItem.dish_id to the kept dish', action='store_true')
+    parser.add_argument('--aggregates', help='recompute the Dish aggregate columns from the cleaned tables and report (check) or overwrite (repair) mismatches', choices=['check', 'repair'], default=None)
+    parser.add_argument('--trace', help='write the time, rows and memory of every cleaning stage per table to this Chrome trace json file', type=str, default=None)
+    parser.add_argument('--incremental', help='skip tables and row blocks whose inputs did not change since the last --incremental run', action='store_true')
+    parser.add_argument('--in-db', help='clean the tables loaded by test.py --reset in place with SQL, in transactions of -c ids, and export them instead of reading -i', action='store_true')
+    parser.add_argument('--db-url', help='SQLAlchemy URL of the database for --in-db (default: NYPL_DB_URL or the MySQL container)', type=str, default=None)
     return parser
 # @end get_parser
 
+def rewrite_output(path, transform, chunksize=None):
+    # Replace a cleaned csv by transform(df) of its rows, chunk by chunk when chunksize is set.
+    # Cleaned files are read without the parquet cache, they are rewritten right after
+    tmp_path = path + '.tmp'
+    chunks = iter_table(path, chunksize, use_cache=False) if chunksize else [read_table(path, use_cache=False)]
+    for i, df in enumerate(chunks):
+        save_data(transform(df), tmp_path, append=i > 0)
+    os.replace(tmp_path, path)
+
+# @begin prune_orphans
+# @in output_files
+# @out output_files
+def prune_orphans(output_folder, chunksize=None):
+    # Drop cleaned rows whose foreign keys point at rows missing from the cleaned
+    # parent table, cascading Menu -> MenuPage -> MenuItem through FOREIGN_KEYS
+    paths = {}
+    for table in dict.fromkeys(t for fk in FOREIGN_KEYS for t in (fk[0], fk[2])):
+        path = os.path.join(output_folder, f"cleaned_{table}.csv")
+        if os.path.isfile(path):
+            paths[table] = path
+    ids = {}
+    dropped = {}
+    for table in dict.fromkeys(fk[0] for fk in FOREIGN_KEYS):
+        fks = [(column, ref_table) for t, column, ref_table in FOREIGN_KEYS if t == table and ref_table in paths]
+        if table not in paths or not fks:
+            continue
+        for _, ref_table in fks:
+            if ref_table not in ids:
+                ids[ref_table] = sorted_ids(read_table(paths[ref_table], columns=['id'], use_cache=False)['id'])
+        dropped[table] = 0
+        def prune(df):
+            keep = np.ones(len(df), dtype=bool)
+            for column, ref_table in fks:
+                keep &= semi_join(df[column], ids[ref_table])
+            dropped[table] += int((~keep).sum())
+            return df[keep]
+        rewrite_output(paths[table], prune, chunksize)
+        # children of this table must see its pruned ids
+        ids.pop(table, None)
+        print(f"Pruned {dropped[table]} orphan rows from cleaned_{table}.csv", flush=True)
+    return dropped
+# @end prune_orphans
+
+# @begin dedup_dishes
+# @in output_files
+# @out output_files
+# @out dish_id_remap.csv
+def dedup_dishes(output_folder, chunksize=None, min_similarity=None):
+    # Merge near duplicate dish names: write the dish id remap next to the cleaned
+    # files and point MenuItem.dish_id at the canonical dishes
+    import dedup  # deferred, scikit-learn dominates the startup of clean.py otherwise
+    if min_similarity is None:
+        min_similarity = dedup.MIN_SIMILARITY
+    startTime = time.perf_counter()
+    dish_path = os.path.join(output_folder, "cleaned_Dish.csv")
+    item_path = os.path.join(output_folder, "cleaned_MenuItem.csv")
+    if not os.path.isfile(dish_path):
+        return None
+    dishes = read_table(dish_path, columns=['id', 'name', 'times_appeared'], use_cache=False)
+    remap = dedup.find_duplicate_dishes(dishes, min_similarity)
+    remap.to_csv(os.path.join(output_folder, "dish_id_remap.csv"))
+    if os.path.isfile(item_path):
+        def remap_dish_ids(df):
+            df['dish_id'] = dedup.apply_remap(df['dish_id'], remap)
+            return df
+        rewrite_output(item_path, remap_dish_ids, chunksize)
+    print(f"Remapped {len(remap)} of {len(dishes)} dishes onto {remap.nunique()} canonical dishes ({time.perf_counter() - startTime:.2f}s)", flush=True)
+    return remap
+# @end dedup_dishes
+
+# @begin dish_aggregates
+# @in output_files
+# @out output_files
+# @out aggregates_report.json
+def dish_aggregates(output_folder, repair=False, chunksize=None):
+    # Check the precomputed Dish aggregates against the cleaned menu items, pages
+    # and menu dates, and with repair overwrite the values that differ
+    startTime = time.perf_counter()
+    dish_path = os.path.join(output_folder, "cleaned_Dish.csv")
+    recomputed = aggregates.load_recomputed(output_folder, prefix="cleaned_", use_cache=False)
+    reports = []
+    def check(df):
+        reports.append(aggregates.check_aggregates(df, recomputed, repair))
+        return df
+    if repair:
+        rewrite_output(dish_path, check, chunksize)
+    else:
+        for df in (iter_table(dish_path, chunksize, use_cache=False) if chunksize else [read_table(dish_path, use_cache=False)]):
+            check(df)
+    report = aggregates.merge_reports(reports)
+    with open(os.path.join(output_folder, "aggregates_report.json"), 'w') as f:
+        json.dump(report, f, indent=2)
+    aggregates.print_report(report)
+    print(f"{'Repaired' if repair else 'Checked'} Dish aggregates in {time.perf_counter() - startTime:.2f}s", flush=True)
+    return report
+# @end dish_aggregates
+
+def clean_table(file_name, input_folder, output_folder, test_folder, chunksize=None):
+    # Clean one table end to end, tables are independent so this can run in a worker process
+    startTime = time.perf_counter()
+    file_path = os.path.join(input_folder, file_name)
+    print(f"Cleaning {file_name}...", flush=True)
+
+    table_name = file_name.replace(".csv", "")
+    # main builds the index, workers read it back from the sidecar
+    failed_ids = fi.load_index(test_folder).get(table_name)
+    output_file_path = os.path.join(output_folder, f"cleaned_{file_name}")
+
+    rows = 0
+    if chunksize:
+        # bounded memory: clean and append one chunk at a time
+        seen_ids = SeenIds()
+        for i, df in enumerate(iter_table(file_path, chunksize)):
+            cleaned_df = clean_data(df, file_name, failed_ids, seen_ids)
+            with tracing.stage('save_data', table_name, len(cleaned_df)):
+                save_data(cleaned_df, output_file_path, append=i > 0)
+            rows += len(cleaned_df)
+    else:
+        with tracing.stage('load_data', table_name, 0) as span:
+            df = load_data(file_path)
+            span.output(len(df))
+        cleaned_df = clean_data(df, file_name, failed_ids)
+        with tracing.stage('save_data', table_name, len(cleaned_df)):
+            save_data(cleaned_df, output_file_path)
+        rows = len(cleaned_df)
+    timeTaken = time.perf_counter() - startTime
+    print(f"Saved cleaned {file_name} to {output_file_path} ({rows} rows, {timeTaken:.2f}s)", flush=True)
+    return rows
+
+def clean_table_in_db(file_name, output_folder, test_folder, db_url=None, batch_rows=None):
+    # Clean the table where test.py --reset loaded it with the same rules as clean_data,
+    # then export the cleaned rows, so the database never needs reloading
+    import indb  # deferred, loads SQLAlchemy and the database driver
+    startTime = time.perf_counter()
+    table_name = file_name.replace(".csv", "")
+    output_file_path = os.path.join(output_folder, f"cleaned_{file_name}")
+    print(f"Cleaning {table_name} in the database...", flush=True)
+    engine = indb.engine_for(db_url)
+    batch_rows = batch_rows or indb.BATCH_ROWS
+    counts = indb.clean_table(engine, table_name, fi.load_index(test_folder).get(table_name), batch_rows)
+    print(f"{table_name}: " + ', '.join(f"{stage} {rows}" for stage, rows in counts.items()), flush=True)
+    rows = 0
+    for i, df in enumerate(indb.export_table(engine, table_name, batch_rows)):
+        save_data(df, output_file_path, append=i > 0)
+        rows += len(df)
+    timeTaken = time.perf_counter() - startTime
+    print(f"Saved cleaned {table_name} table to {output_file_path} ({rows} rows, {timeTaken:.2f}s)", flush=True)
+    return rows
+
+def clean_table_incremental(file_name, input_folder, output_folder, test_folder, block_rows, entry):
+    # Like clean_table, but driven by the table's manifest entry from the last run:
+    # unchanged inputs skip the table, otherwise only row blocks whose content or
+    # preceding ids changed are cleaned again. Returns (rows, new entry, rebuilt)
+    startTime = time.perf_counter()
+    file_path = os.path.join(input_folder, file_name)
+    table_name = file_name.replace(".csv", "")
+    failed_ids = fi.load_index(test_folder).get(table_name)
+    failed_digest = fi.ids_digest(failed_ids)
+    output_file_path = os.path.join(output_folder, f"cleaned_{file_name}")
+
+    stat = mf.file_stat(file_path)
+    if (entry.get('input', {}).get('size') == stat['size'] and entry['input'].get('mtime_ns') == stat['mtime_ns']
+            and entry.get('failed_ids') == failed_digest and entry.get('output') == mf.file_stat(output_file_path)):
+        print(f"Skipping {file_name}, inputs unchanged since the last run", flush=True)
+        return entry['rows'], entry, False
+
+    print(f"Cleaning {file_name} incrementally...", flush=True)
+    parts_dir = mf.parts_folder(output_folder, table_name)
+    os.makedirs(parts_dir, exist_ok=True)
+    # a different failed-id list can drop rows from any block
+    old_blocks = entry.get('blocks', []) if entry.get('failed_ids') == failed_digest else []
+    blocks = []
+    seen_ids = SeenIds()
+    chain = ''
+    rows = reused = 0
+    for i, df in enumerate(iter_table(file_path, block_rows)):
+        digest = mf.frame_digest(df)
+        part_path = mf.part_path(parts_dir, i)
+        old = old_blocks[i] if i < len(old_blocks) else None
+        if (old and old['hash'] == digest and old['seen'] == chain and os.path.isfile(part_path)
+                and (i > 0 or os.path.isfile(os.path.join(parts_dir, mf.HEADER_NAME)))):
+            # replay the block's ids so later blocks still drop repeats of them
+            if 'id' in df.columns:
+                seen_ids.first_seen(df['id'][(df['id'] != 0).fillna(True)])
+            block_rows_out = old['rows']
+            reused += 1
+        else:
+            cleaned_df = clean_data(df, file_name, failed_ids, seen_ids)
+            if i == 0:
+                save_data(cleaned_df.iloc[:0], os.path.join(parts_dir, mf.HEADER_NAME))
+            cleaned_df.to_csv(part_path, index=False, header=False)
+            block_rows_out = len(cleaned_df)
+        blocks.append({'hash': digest, 'seen': chain, 'rows': block_rows_out})
+        rows += block_rows_out
+        if 'id' in df.columns:
+            chain = mf.chain_digest(chain, df['id'])
+    # blocks past the end of a shrunk input
+    for name in os.listdir(parts_dir):
+        if name != mf.HEADER_NAME and int(name.split('.')[0]) >= len(blocks):
+            os.remove(os.path.join(parts_dir, name))
+    mf.assemble_parts(parts_dir, len(blocks), output_file_path)
+
+    entry = {
+        'input': mf.file_stat(file_path),
+        'failed_ids': failed_digest,
+        'blocks': blocks,
+        'rows': rows,
+    }
+    timeTaken = time.perf_counter() - startTime
+    print(f"Saved cleaned {file_name} to {output_file_path} ({rows} rows, {reused}/{len(blocks)} blocks reused, {timeTaken:.2f}s)", flush=True)
+    return rows, entry, True
+
 def main():
-    args = get_parser().parse_args()
+    parser = get_parser()
+    args = parser.parse_args()
     print('Configs =', args)
+    if args.in_db and args.incremental:
+        parser.error('--incremental tracks csv inputs, it cannot be combined with --in-db')
 
     input_folder = args.inpdir
     output_folder = args.outdir
     test_folder = args.testdir
 
     os.makedirs(output_folder, exist_ok=True)
+    # parse the failed id json once, the table jobs load the sidecar it leaves
+    index = fi.load_index(test_folder)
+    print(f"Loaded failed ids: {', '.join(f'{table} {len(ids)}' for table, ids in sorted(index.items()))}", flush=True)
 
-    failed_ids_by_table = {
-        "Dish": ["TestDishYearValid_FailedID.json", "TestDisPriceValid_FailedID.json"],
-        "Menu": ["TestTablesSchema_FailedID.json"],
-        "MenuPage": ["TestMenuPageDuplicate_FailedID.json", "TestMenuPageNumberValid_FailedID.json"],
-        "MenuItem": ["TestMenuItemNumberValid_FailedID.json", "TestMenuItemDateValid_FailedID.json"]
-    }
-
-    for file_name in os.listdir(input_folder):
-        if file_name.endswith('.csv'):
-            file_path = os.path.join(input_folder, file_name)
-            print(f"Cleaning {file_name}...")
+    if args.in_db:
+        from tests import TABLE_MAP  # deferred, only the database mode needs the models
+        file_names = [f"{table}.csv" for table in TABLE_MAP]
+    else:
+        # largest tables first so they do not end up as the stragglers of a parallel run
+        file_names = sorted(
+            (f for f in os.listdir(input_folder) if f.endswith('.csv')),
+            key=lambda f: os.path.getsize(os.path.join(input_folder, f)),
+            reverse=True,
+        )
+    if args.incremental:
+        block_rows = args.chunksize or BLOCK_ROWS
+        manifest = mf.load_manifest(output_folder)
+        if manifest.get('rules_version') != RULES_VERSION or manifest.get('block_rows') != block_rows:
+            manifest = {'rules_version': RULES_VERSION, 'block_rows': block_rows, 'tables': {}}
+        # stages run on the assembled outputs once every table is cleaned
+        stages = {'prune_orphans': args.prune_orphans, 'dedup_dishes': args.dedup_dishes, 'aggregates': args.aggregates}
+        if manifest.get('stages') != stages:
+            # blocks stay valid, but every output file has to be assembled again
+            for entry in manifest['tables'].values():
+                entry.pop('output', None)
+        manifest['stages'] = stages
+        tables = manifest['tables']
+        jobs = {
+            f: (clean_table_incremental, f, input_folder, output_folder, test_folder, block_rows, tables.get(f.replace(".csv", ""), {}))
+            for f in file_names
+        }
+    elif args.in_db:
+        jobs = {f: (clean_table_in_db, f, output_folder, test_folder, args.db_url, args.chunksize) for f in file_names}
+    else:
+        jobs = {f: (clean_table, f, input_folder, output_folder, test_folder, args.chunksize) for f in file_names}
 
-            table_name = file_name.replace(".csv", "")
-            df = load_data(file_path)
+    if args.trace:
+        # workers hand their stage events back with the result
+        jobs = {f: (tracing.run_traced, *job) for f, job in jobs.items()}
+    startTime = time.perf_counter()
+    failed = []
+    results = {}
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = {executor.submit(*jobs[f]): f for f in file_names}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception:
+                    print(f"Failed to clean {futures[future]}:\n{traceback.format_exc()}", flush=True)
+                    failed.append(futures[future])
+    else:
+        for f in file_names:
+            try:
+                func, *func_args = jobs[f]
+                results[f] = func(*func_args)
+            except Exception:
+                print(f"Failed to clean {f}:\n{traceback.format_exc()}", flush=True)
+                failed.append(f)
 
-            relevant_tests = failed_ids_by_table.get(table_name, [])
-            failed_ids_files = [os.path.join(test_folder, f) for f in relevant_tests]
+    if args.trace:
+        events = [event for _, job_events in results.values() for event in job_events]
+        results = {f: result for f, (result, _) in results.items()}
+        tracing.write_trace(args.trace, events)
+        for (table, name), total in tracing.summarize(events)[:10]:
+            print(f"{table}.{name}: {total['ms']:.1f}ms, {total['rows_in']} -> {total['rows_out']} rows, {total['rows_modified']} modified")
+        print(f"Saved trace of {len(events)} stage events to {args.trace}")
 
-            cleaned_df = clean_data(df, file_name, failed_ids_files)
+    post_stages = args.prune_orphans or args.dedup_dishes or args.aggregates
+    if args.incremental:
+        rebuilt = any(result[2] for result in results.values())
+        if post_stages and rebuilt and not failed:
+            # outputs skipped this run went through the stages with the old tables,
+            # start every table again from its cleaned blocks
+            for f, (_, entry, table_rebuilt) in results.items():
+                if not table_rebuilt:
+                    table = f.replace(".csv", "")
+                    mf.assemble_parts(mf.parts_folder(output_folder, table), len(entry['blocks']),
+                                      os.path.join(output_folder, f"cleaned_{f}"))
+    if post_stages:
+        if failed:
+            print("Skipping dish dedup, orphan pruning and aggregates, not every table was cleaned")
+        elif not args.incremental or rebuilt:
+            if args.dedup_dishes:
+                dedup_dishes(output_folder, args.chunksize)
+            if args.prune_orphans:
+                prune_orphans(output_folder, args.chunksize)
+            if args.aggregates:
+                dish_aggregates(output_folder, args.aggregates == 'repair', args.chunksize)
+    if args.incremental:
+        manifest['tables'] = {}
+        for f, (_, entry, _) in results.items():
+            # outputs still waiting for the stages must not look up to date next run
+            entry['output'] = None if post_stages and failed else mf.file_stat(os.path.join(output_folder, f"cleaned_{f}"))
+            manifest['tables'][f.replace(".csv", "")] = entry
+        mf.save_manifest(output_folder, manifest)
 
-            output_file_path = os.path.join(output_folder, f"cleaned_{file_name}")
-            save_data(cleaned_df, output_file_path)
-            print(f"Saved cleaned {file_name} to {output_file_path}")
+    print(f"Cleaned {len(file_names) - len(failed)}/{len(file_names)} tables in {time.perf_counter() - startTime:.2f}s")
+    if failed:
+        print(f"Failed tables: {failed}")
+        sys.exit(1)
 # @end main
 
 if __name__ == '__main__':
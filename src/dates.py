@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+YEAR_MIN = 1500
+YEAR_MAX = 2025
+
+# Same digit patterns datetime.strptime uses for %Y, %m and %d, so a string
+# matches here exactly when one of the clamp_year formats accepts it:
+# '%Y-%m-%d', '%Y/%m/%d', '%Y-%m', '%Y/%m' or '%Y'. \Z, not $, which would also
+# match before a trailing newline strptime rejects
+_DATE_PATTERN = (
+    r'^(?P<year>\d\d\d\d)'
+    r'(?:(?P<sep>[-/])(?P<month>1[0-2]|0[1-9]|[1-9])'
+    r'(?:(?P=sep)(?P<day>3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9]))?)?\Z'
+)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Values on the edges of the strptime formats, checked by python src/dates.py
+EDGE_CASES = [
+    '1900', '1900-01-01', '1900/1/1', '1900-1', '1900/01', '1900-01- 1', '0000', '0001-01-01',
+    '1400-06-15', '2030-12-31', '1600-02-29', '1900-02-29', '2000-02-30', '1900-13', '1900-00',
+    '1900-01/01', '19000', ' 1900', '1900 ', '1900\n', '1900-01-01\n', '1900\r', '\n1900',
+    '\u0661\u0669\u0660\u0660', '', 'nan', None, float('nan'),
+]
+
+
+def _to_int(group, default):
+    # Regex group to int array, unmatched rows fall back to default
+    return group.fillna(str(default)).astype(np.int64).to_numpy()
+
+
+def _zfill(values, width):
+    return pd.Series(values).astype(str).str.zfill(width)
+
+
+def _days_in_month(years, months):
+    days = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])[months]
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    return days + ((months == 2) & leap)
+
+
+def parse_dates(values, full_only=False):
+    # Parse raw date strings into (year, month, day) int arrays plus a validity mask,
+    # full_only accepts '%Y-%m-%d' and nothing else
+    parts = pd.Series(values, dtype=object).str.extract(_DATE_PATTERN)
+    year = _to_int(parts['year'], 1)
+    month = _to_int(parts['month'], 1)
+    day = _to_int(parts['day'], 1)
+    # strptime also rejects year 0 and days past the end of the month
+    valid = parts['year'].notna().to_numpy() & (year >= 1)
+    valid &= day <= _days_in_month(year, month)
+    if full_only:
+        valid &= (parts['sep'] == '-').to_numpy() & parts['day'].notna().to_numpy()
+    return year, month, day, valid
+
+
+def clamp_years(series, lower=YEAR_MIN, upper=YEAR_MAX):
+    # Vectorized clean.clamp_year: every distinct raw value is parsed once,
+    # unparseable values become '' and the year is clamped into [lower, upper]
+    codes, uniques = pd.factorize(series)
+    year, month, day, valid = parse_dates([str(u) for u in uniques])
+    year = np.clip(year, lower, upper)
+    if (valid & (day > _days_in_month(year, month))).any():
+        # datetime.replace raises for Feb 29 moved onto a non leap year, keep that behavior
+        raise ValueError('day is out of range for month')
+    formatted = (_zfill(year, 4) + '-' + _zfill(month, 2) + '-' + _zfill(day, 2)).to_numpy(dtype=object)
+    # trailing '' slot is what NaN (code -1) and unparseable values map to
+    formatted = np.append(np.where(valid, formatted, ''), '')
+    return pd.Series(formatted[codes], index=series.index, name=series.name)
+
+
+def date_years(series, full_only=False):
+    # Year of every date clamp_year accepts, NaN where the value is not a date
+    codes, uniques = pd.factorize(series)
+    year, _, _, valid = parse_dates([str(u) for u in uniques], full_only=full_only)
+    years = np.append(np.where(valid, year, np.nan), np.nan)
+    return pd.Series(years[codes], index=series.index, name=series.name)
+
+
+def full_date_years(series):
+    # Year of every '%Y-%m-%d' value, NaN where the value is not such a date
+    return date_years(series, full_only=True)
+
+
+def clamp_year_values(series, lower=YEAR_MIN, upper=YEAR_MAX):
+    # Clamp integer year columns, NaN maps to upper the way min(upper, max(nan, lower)) does
+    return series.clip(lower=lower, upper=upper).fillna(upper)
+
+
+def parse_timestamps(series, suffix=' UTC', format=TIMESTAMP_FORMAT):
+    # Parse the dump's "YYYY-mm-dd HH:MM:SS UTC" timestamps with a fixed format,
+    # each distinct value once, anything else becomes NaT
+    codes, uniques = pd.factorize(series)
+    raw = pd.Series(uniques, dtype=object).str.replace(suffix, '', regex=False)
+    parsed = np.append(pd.to_datetime(raw, format=format, errors='coerce').to_numpy(), np.datetime64('NaT'))
+    return pd.Series(parsed[codes], index=series.index, name=series.name)
+
+
+if __name__ == '__main__':
+    # Check clamp_years against the scalar clean.clamp_year on EDGE_CASES and the
+    # date column of every csv given, exits with 1 on any mismatch
+    import argparse
+    import sys
+    from cache import read_table
+    from clean import clamp_year
+    parser = argparse.ArgumentParser(description='compare the vectorized and the scalar clamp_year')
+    parser.add_argument('files', nargs='*', help='csv files with a date column, e.g. Menu.csv')
+    samples = {'EDGE_CASES': pd.Series(EDGE_CASES, dtype=object)}
+    for file_path in parser.parse_args().files:
+        samples[file_path] = read_table(file_path, columns=['date'])['date'].astype(object)
+    mismatches = 0
+    for name, values in samples.items():
+        expected = values.map(clamp_year, na_action=None)
+        actual = clamp_years(values)
+        diff = expected != actual
+        mismatches += int(diff.sum())
+        print(f'{name}: {len(values)} values, {int(diff.sum())} mismatches')
+        if diff.any():
+            print(pd.DataFrame({'value': values, 'clamp_year': expected, 'clamp_years': actual})[diff].to_string())
+    sys.exit(1 if mismatches else 0)
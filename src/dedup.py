@@ -0,0 +1,123 @@
+import argparse
+import numpy as np
+import pandas as pd
+import textdistance
+import time
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from cache import read_table
+from integrity import semi_join
+
+# Candidate pairs come from a character n-gram TF-IDF index: every name is only
+# compared with its N_NEIGHBORS most similar names, and only pairs whose cosine
+# similarity reaches MIN_COSINE are scored with textdistance. N-grams found in
+# more than MAX_DF of the names are left out of the index, they would make
+# nearly every name a neighbour of every other one
+NGRAM_RANGE = (3, 3)
+MAX_DF = 0.02
+N_NEIGHBORS = 5
+MIN_COSINE = 0.6
+MIN_SIMILARITY = 0.9
+CHUNK_ROWS = 2000
+
+
+def normalize_names(names):
+    # Case, accents, punctuation and whitespace do not make a different dish:
+    # 'Café', 'cafe ' and 'CAFE.' all become 'cafe'
+    names = pd.Series(names, dtype='string').str.normalize('NFKD')
+    names = names.str.encode('ascii', errors='ignore').str.decode('ascii')
+    names = names.str.lower().str.replace(r'[^\w\s]', ' ', regex=True)
+    return names.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def candidate_pairs(names, n_neighbors=N_NEIGHBORS, min_cosine=MIN_COSINE, max_df=MAX_DF):
+    # (i, j) index pairs, i < j, of each name and its nearest names in the TF-IDF
+    # space, found with sparse products of CHUNK_ROWS names against all of them
+    if len(names) < 2:
+        return np.empty((0, 2), dtype=np.int64)
+    vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=NGRAM_RANGE, max_df=max_df, dtype=np.float32)
+    try:
+        tfidf = vectorizer.fit_transform(names)
+    except ValueError:  # every n-gram is too common, or there are none
+        return np.empty((0, 2), dtype=np.int64)
+    tfidf_t = tfidf.T.tocsr()
+    pairs = []
+    for start in range(0, len(names), CHUNK_ROWS):
+        sim = (tfidf[start:start + CHUNK_ROWS] @ tfidf_t).tocoo()
+        rows, cols, data = sim.row + start, sim.col, sim.data
+        close = (data >= min_cosine) & (rows != cols)
+        rows, cols, data = rows[close], cols[close], data[close]
+        # n_neighbors best per row: sort by row, then by decreasing similarity
+        order = np.lexsort((-data, rows))
+        rows, cols = rows[order], cols[order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        best = rank < n_neighbors
+        pairs.append(np.column_stack([rows[best], cols[best]]))
+    pairs = np.sort(np.concatenate(pairs).astype(np.int64), axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def score_pairs(names, pairs, metric=textdistance.levenshtein):
+    # Normalized textdistance similarity of every candidate pair
+    names = np.asarray(names, dtype=object)
+    return np.fromiter((metric.normalized_similarity(names[i], names[j]) for i, j in pairs), dtype=np.float64, count=len(pairs))
+
+
+def find_duplicate_dishes(dishes, min_similarity=MIN_SIMILARITY, n_neighbors=N_NEIGHBORS, min_cosine=MIN_COSINE):
+    # Dish id remap: a Series of canonical dish ids indexed by the sorted ids of
+    # the dishes merged into them. Names equal after normalize_names are merged
+    # outright, distinct normalized names are matched by candidate_pairs and
+    # score_pairs, and matches are grouped transitively. The canonical dish of
+    # a group is the one appearing most often, then the lowest id
+    dishes = dishes[dishes['id'].notna()]
+    # names with nothing left after normalizing are never merged
+    codes, uniques = pd.factorize(normalize_names(dishes['name']).replace('', pd.NA))
+    named = codes >= 0
+    pairs = candidate_pairs(list(uniques), n_neighbors, min_cosine)
+    pairs = pairs[score_pairs(uniques, pairs) >= min_similarity]
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(len(uniques), len(uniques)))
+    _, labels = connected_components(graph, directed=False)
+
+    groups = pd.DataFrame({
+        'id': dishes['id'].to_numpy(dtype=np.int64)[named],
+        'group': labels[codes[named]],
+        'times_appeared': dishes['times_appeared'].fillna(0).to_numpy()[named] if 'times_appeared' in dishes else 0,
+    })
+    groups = groups.sort_values(['group', 'times_appeared', 'id'], ascending=[True, False, True])
+    canonical = groups.groupby('group')['id'].transform('first')
+    remap = pd.Series(canonical.to_numpy(), index=groups['id'].to_numpy(), name='canonical_id')
+    remap = remap[remap.index != remap.to_numpy()].sort_index()
+    remap.index.name = 'dish_id'
+    return remap
+
+
+def apply_remap(values, remap):
+    # Replace the dish ids found in remap by their canonical id, others are kept
+    values = pd.Series(values)
+    found = semi_join(values, remap.index.to_numpy())
+    if not found.any():
+        return values
+    values = values.copy()
+    pos = np.searchsorted(remap.index.to_numpy(), values[found].to_numpy(dtype=np.int64))
+    values[found] = remap.to_numpy()[pos]
+    return values
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='find near duplicate dish names')
+    parser.add_argument('-i', '--input', help='path to the (cleaned) Dish csv', type=str, default='../data/NYPL-menus-clean/cleaned_Dish.csv')
+    parser.add_argument('-o', '--output', help='path of the dish id remap csv', type=str, default='dish_id_remap.csv')
+    parser.add_argument('--min-similarity', help='textdistance similarity needed to merge two names', type=float, default=MIN_SIMILARITY)
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    print('Configs =', args)
+    startTime = time.perf_counter()
+    dishes = read_table(args.input, columns=['id', 'name', 'times_appeared'])
+    remap = find_duplicate_dishes(dishes, args.min_similarity)
+    remap.to_csv(args.output)
+    print(f"{len(remap)} of {len(dishes)} dishes remapped to {remap.nunique()} canonical dishes in {time.perf_counter() - startTime:.2f}s, saved to {args.output}")
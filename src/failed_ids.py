@@ -0,0 +1,92 @@
+import glob
+import hashlib
+import json
+import numpy as np
+import os
+
+from integrity import semi_join
+from manifest import files_digest
+
+# Sidecar next to the *_FailedID.json files holding the index below
+INDEX_NAME = 'failed_ids.npz'
+# Bump whenever the mappings below change, so old sidecars are rebuilt
+INDEX_VERSION = 1
+SUFFIX = '_FailedID.json'
+# Table whose ids a test class reports
+CLASS_TABLES = {
+    'TestDishYearValid': 'Dish',
+    'TestDisPriceValid': 'Dish',
+    'TestMenuPageDuplicate': 'MenuPage',
+    'TestMenuPageNumberValid': 'MenuPage',
+    'TestMenuItemNumberValid': 'MenuItem',
+    'TestMenuItemDateValid': 'MenuItem',
+}
+# TestTablesSchema spans tables, its foreign key checks report the child row ids
+METHOD_TABLES = {
+    ('TestTablesSchema', 'test_menu_page_menu_id_fk'): 'MenuPage',
+    ('TestTablesSchema', 'test_menu_item_menu_page_id_fk'): 'MenuItem',
+    ('TestTablesSchema', 'test_menu_item_dish_id_fk'): 'MenuItem',
+}
+# Failures clean_data repairs with its clamp stages, those rows are kept
+REPAIRED = {
+    ('TestDishYearValid', 'test_first_appeared'),
+    ('TestDishYearValid', 'test_last_appeared'),
+    ('TestMenuItemNumberValid', 'test_price_high_price'),
+    ('TestMenuItemDateValid', 'test_create_update'),
+}
+
+
+def method_table(class_name, method):
+    # Table a test method's failed ids belong to, None when they are not dropped
+    if (class_name, method) in REPAIRED:
+        return None
+    return METHOD_TABLES.get((class_name, method), CLASS_TABLES.get(class_name))
+
+
+def failed_id_files(test_folder):
+    return sorted(glob.glob(os.path.join(test_folder, f'*{SUFFIX}')))
+
+
+def build_index(test_folder):
+    # Union of the failed ids of every method per table, as sorted unique int64 arrays
+    ids = {}
+    for path in failed_id_files(test_folder):
+        class_name = os.path.basename(path)[:-len(SUFFIX)]
+        with open(path) as f:
+            methods = json.load(f)
+        for method, values in methods.items():
+            table = method_table(class_name, method)
+            if table is not None:
+                ids.setdefault(table, []).append(np.asarray(values, dtype=np.int64))
+    return {table: np.unique(np.concatenate(arrays)) for table, arrays in ids.items()}
+
+
+def load_index(test_folder):
+    # build_index, reusing the npz sidecar while the json files are unchanged
+    files = failed_id_files(test_folder)
+    if not files:
+        return {}
+    path = os.path.join(test_folder, INDEX_NAME)
+    digest = f'{INDEX_VERSION}:{files_digest(files)}'
+    if os.path.isfile(path):
+        with np.load(path) as index:
+            if str(index['digest']) == digest:
+                return {table: index[table] for table in index.files if table != 'digest'}
+    index = build_index(test_folder)
+    # np.savez only keeps names ending in .npz
+    tmp_path = f'{path[:-len(".npz")]}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_path, digest=np.array(digest), **index)
+    os.replace(tmp_path, path)
+    return index
+
+
+def ids_digest(ids):
+    # Identifies a table's failed ids in the --incremental manifest
+    return hashlib.sha1(b'' if ids is None else ids.tobytes()).hexdigest()
+
+
+def not_failed(ids, failed):
+    # Anti-join mask: rows whose id is not in the sorted failed id array
+    if failed is None or len(failed) == 0:
+        return np.ones(len(ids), dtype=bool)
+    return ~semi_join(ids, failed)
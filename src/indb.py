@@ -0,0 +1,121 @@
+import pandas as pd
+from sqlalchemy import DateTime, bindparam, case, delete, func, or_, select, update
+
+from cache import apply_schema
+from dates import TIMESTAMP_FORMAT, YEAR_MAX, YEAR_MIN, clamp_years
+from tests import TABLE_MAP, configure_engine, get_engine
+
+# The clean_data rules as set-based statements on the tables test.py --reset loaded.
+# Every statement runs over consecutive id ranges of this many ids, one transaction
+# per range, so no transaction holds locks on a whole table
+BATCH_ROWS = 100000
+# Failed ids sent per IN list
+IN_LIST = 1000
+# Foreign keys whose 0 placeholder drops the row, as in remove_failed_ids
+ZERO_REFERENCES = ['menu_id', 'menu_page_id', 'dish_id']
+
+
+def engine_for(url=None):
+    # url overrides NYPL_DB_URL
+    return configure_engine(url) if url else get_engine()
+
+
+def id_ranges(conn, table, batch_rows=BATCH_ROWS):
+    # Inclusive (low, high) id ranges covering the table
+    low, high = conn.execute(select(func.min(table.c.id), func.max(table.c.id))).one()
+    if low is None:
+        return []
+    return [(start, min(start + batch_rows - 1, high)) for start in range(low, high + 1, batch_rows)]
+
+
+def run_batched(engine, table, statement, batch_rows=BATCH_ROWS):
+    # Run a DELETE or UPDATE over every id range of table, returns the rows it affected
+    with engine.connect() as conn:
+        ranges = id_ranges(conn, table, batch_rows)
+    rows = 0
+    for low, high in ranges:
+        with engine.begin() as conn:
+            rows += conn.execute(statement.where(table.c.id.between(low, high))).rowcount
+    return rows
+
+
+def delete_ids(engine, table, ids, batch_rows=BATCH_ROWS):
+    # Delete the rows with the given sorted ids, batch_rows ids per transaction
+    ids = [] if ids is None else ids.tolist()
+    rows = 0
+    for start in range(0, len(ids), batch_rows):
+        with engine.begin() as conn:
+            batch = ids[start:start + batch_rows]
+            for i in range(0, len(batch), IN_LIST):
+                rows += conn.execute(delete(table).where(table.c.id.in_(batch[i:i + IN_LIST]))).rowcount
+    return rows
+
+
+def clamp_dates(engine, table):
+    # clamp_year on the distinct dates: each changed value is rewritten with one UPDATE,
+    # NULL becomes '' like it does in the csv
+    c = table.c
+    with engine.connect() as conn:
+        dates = pd.Series(conn.execute(select(c.date).distinct()).scalars().all(), dtype=object)
+    clamped = clamp_years(dates)
+    changed = [
+        {'old_date': old, 'new_date': new}
+        for old, new in zip(dates, clamped)
+        if old is not None and old != new
+    ]
+    rows = 0
+    with engine.begin() as conn:
+        if changed:
+            statement = update(table).where(c.date == bindparam('old_date')).values(date=bindparam('new_date'))
+            rows += conn.execute(statement, changed).rowcount
+        rows += conn.execute(update(table).where(c.date.is_(None)).values(date='')).rowcount
+    return rows
+
+
+def clean_table(engine, table_name, failed_ids=None, batch_rows=BATCH_ROWS):
+    # Apply the clean_data stages to the table in place, returns {stage: rows affected}.
+    # The primary key already kept the first row of every duplicate id at insert time
+    table = TABLE_MAP[table_name].__table__
+    c = table.c
+    counts = {'remove_zero_ids': run_batched(engine, table, delete(table).where(c.id == 0), batch_rows)}
+    zero_refs = [c[col] == 0 for col in ZERO_REFERENCES if col in c]
+    counts['remove_failed_ids'] = delete_ids(engine, table, failed_ids, batch_rows)
+    if zero_refs:
+        counts['remove_failed_ids'] += run_batched(engine, table, delete(table).where(or_(*zero_refs)), batch_rows)
+    if 'price' in c and 'high_price' in c:
+        statement = update(table).where(c.high_price < c.price).values(high_price=c.price)
+        counts['clamp_high_price'] = run_batched(engine, table, statement, batch_rows)
+    if 'created_at' in c and 'updated_at' in c:
+        statement = update(table).where(c.created_at > c.updated_at).values(updated_at=c.created_at)
+        counts['clamp_updated_at'] = run_batched(engine, table, statement, batch_rows)
+    if 'date' in c:
+        counts['clamp_year'] = clamp_dates(engine, table)
+    for col in ['first_appeared', 'last_appeared']:
+        if col in c:
+            # clamp_year_values, NULL becomes YEAR_MAX
+            statement = (
+                update(table)
+                .where(or_(c[col].is_(None), c[col] < YEAR_MIN, c[col] > YEAR_MAX))
+                .values({col: case((c[col] < YEAR_MIN, YEAR_MIN), else_=YEAR_MAX)})
+            )
+            counts[f'clamp_{col}'] = run_batched(engine, table, statement, batch_rows)
+    return counts
+
+
+def export_table(engine, table_name, batch_rows=BATCH_ROWS):
+    # Stream the table in id order as frames of batch_rows rows with the csv dtypes,
+    # timestamps formatted back into the dump's "... UTC" strings
+    table = TABLE_MAP[table_name].__table__
+    timestamps = [col.name for col in table.columns if isinstance(col.type, DateTime)]
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_rows).execute(select(table).order_by(table.c.id))
+        columns = list(result.keys())
+        empty = True
+        for rows in result.partitions():
+            df = pd.DataFrame(rows, columns=columns)
+            for col in timestamps:
+                df[col] = pd.to_datetime(df[col]).dt.strftime(TIMESTAMP_FORMAT) + ' UTC'
+            empty = False
+            yield apply_schema(df, table_name)
+        if empty:
+            yield apply_schema(pd.DataFrame(columns=columns), table_name)
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+# (table, column, referenced table), parents before children so pruning in
+# this order cascades Menu -> MenuPage -> MenuItem in one pass
+FOREIGN_KEYS = [
+    ('MenuPage', 'menu_id', 'Menu'),
+    ('MenuItem', 'menu_page_id', 'MenuPage'),
+    ('MenuItem', 'dish_id', 'Dish'),
+]
+
+
+def sorted_ids(values):
+    # Sorted unique int64 ids, missing values dropped
+    values = pd.Series(values).dropna()
+    return np.unique(values.to_numpy(dtype=np.int64))
+
+
+def semi_join(values, ids):
+    # Mask of values found in the sorted id array ids, missing values never match
+    values = pd.Series(values)
+    present = values.notna().to_numpy()
+    keys = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    found = np.zeros(len(keys), dtype=bool)
+    if len(ids):
+        pos = np.searchsorted(ids, keys[present])
+        found[present] = ids[np.minimum(pos, len(ids) - 1)] == keys[present]
+    return found
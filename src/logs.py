@@ -0,0 +1,29 @@
+import logging
+
+# Terminal colors of the log messages
+RED     = '\033[31m'
+GREEN   = '\033[32m'
+YELLOW  = '\033[33m'
+BLUE    = '\033[34m'
+MAGENTA = '\033[35m'
+CYAN    = '\033[36m'
+RESET   = '\033[0m'
+
+class ConditionalFormatter(logging.Formatter):
+    def format(self, record):
+        if hasattr(record, 'simple') and record.simple:
+            return record.getMessage()
+        else:
+            return super().format(record)
+
+def get_logger(fn='test.log'):
+    console_handler = logging.StreamHandler()
+    console_formatter = ConditionalFormatter('%(levelname)s - %(message)s')
+    console_handler.setFormatter(console_formatter)
+    file_handler = logging.FileHandler(fn)
+    file_formatter = ConditionalFormatter('%(asctime)s - %(levelname)s - %(message)s')
+    file_handler.setFormatter(file_formatter)
+    logging.basicConfig(level=logging.DEBUG, handlers=[console_handler, file_handler])
+
+    logger = logging.getLogger(__name__)
+    return logger
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import pandas as pd
+
+# Incremental cleaning state kept in the output folder: manifest.json describes
+# the inputs each cleaned table was built from, .parts/{Table}/ holds the
+# cleaned row blocks (no header) the final csv is assembled from
+MANIFEST_NAME = 'manifest.json'
+PARTS_DIR = '.parts'
+HEADER_NAME = 'header.csv'
+
+
+def load_manifest(output_folder):
+    path = os.path.join(output_folder, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:  # half written manifest, rebuild everything
+        return {}
+
+
+def save_manifest(output_folder, manifest):
+    # Written atomically, an interrupted run leaves the previous manifest in place
+    path = os.path.join(output_folder, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def parts_folder(output_folder, table):
+    return os.path.join(output_folder, PARTS_DIR, table)
+
+
+def part_path(parts_dir, i):
+    return os.path.join(parts_dir, f'{i:05d}.csv')
+
+
+def file_stat(path):
+    # Cheap identity of a file, None when it does not exist
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def files_digest(paths):
+    # Content hash of a list of files, a missing file hashes differently from an empty one
+    sha1 = hashlib.sha1()
+    for path in paths:
+        sha1.update(os.path.basename(path).encode())
+        if not os.path.isfile(path):
+            sha1.update(b'\0missing')
+            continue
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+    return sha1.hexdigest()
+
+
+def frame_digest(df):
+    # Content hash of a row block: column names plus every value, not the index
+    sha1 = hashlib.sha1(','.join(map(str, df.columns)).encode())
+    sha1.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return sha1.hexdigest()
+
+
+def chain_digest(previous, ids):
+    # Running hash of the ids of every block so far, a block's output also depends
+    # on the ids before it because repeated ids keep their first occurrence
+    sha1 = hashlib.sha1(previous.encode())
+    sha1.update(pd.util.hash_pandas_object(ids, index=False).to_numpy().tobytes())
+    return sha1.hexdigest()
+
+
+def assemble_parts(parts_dir, n_parts, output_path):
+    # Concatenate the header and the first n_parts blocks into output_path
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as out:
+        for path in [os.path.join(parts_dir, HEADER_NAME)] + [part_path(parts_dir, i) for i in range(n_parts)]:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    out.write(block)
+    os.replace(tmp_path, output_path)
@@ -1,7 +1,15 @@
 import argparse
 import glob
+import json
+import numpy as np
 import os
 import pandas as pd
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import iter_table, table_name
+from clean import SeenIds
+from validate import RANGES
 
 
 def get_parser():
@@ -14,58 +22,152 @@ def get_parser():
         type=str,
         default="../data/NYPL-menus",  # Default dataset path
     )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="path of the json report",
+        type=str,
+        default="profiling_report.json",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunksize",
+        help="rows profiled per chunk",
+        type=int,
+        default=500000,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="number of files profiled in parallel processes",
+        type=int,
+        default=1,
+    )
     return parser
 
 
-def count_missing_values(df):
-    # Count the number of missing values per column
-    return df.isnull().sum()
-
+class ColumnProfile:
+    # Running metrics of one column, updated chunk by chunk
+    def __init__(self, dtype):
+        self.dtype = str(dtype)
+        self.numeric = pd.api.types.is_numeric_dtype(dtype)
+        self.inferred = None
+        self.missing = 0
+        self.zeros = 0
+        self.min = None
+        self.max = None
+        self.distinct = None
+        self.out_of_range = None
+
+    def update(self, s, bounds=None):
+        self.missing += int(s.isna().sum())
+        values = s.dropna()
+        if len(values) == 0:
+            return
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # profile the values, unordered categories have no min/max
+            values = values.astype(values.cat.categories.dtype)
+        inferred = pd.api.types.infer_dtype(values, skipna=True)
+        self.inferred = inferred if self.inferred in (None, inferred) else "mixed"
+        uniques = values.unique()
+        if self.distinct is not None:
+            uniques = pd.unique(np.concatenate([self.distinct, np.asarray(uniques)]))
+        self.distinct = np.asarray(uniques)
+        lo, hi = values.min(), values.max()
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+        if self.numeric:
+            self.zeros += int((values == 0).sum())
+            if bounds is not None:
+                lower, upper = bounds
+                outside = values < lower
+                if upper is not None:
+                    outside |= values > upper
+                self.out_of_range = (self.out_of_range or 0) + int(outside.sum())
+
+    def to_dict(self):
+        scalar = lambda v: v.item() if isinstance(v, np.generic) else v
+        res = {
+            "dtype": self.dtype,
+            "inferred": self.inferred,
+            "missing": self.missing,
+            "distinct": 0 if self.distinct is None else len(self.distinct),
+            "min": scalar(self.min),
+            "max": scalar(self.max),
+        }
+        if self.numeric:
+            res["zeros"] = self.zeros
+        if self.out_of_range is not None:
+            res["out_of_range"] = self.out_of_range
+        return res
+
+
+def profile_file(f, chunksize=500000):
+    # One pass over the file: missing values, zeros, min/max, distinct counts,
+    # dtype inference, values outside the tested ranges and duplicated ids
+    startTime = time.perf_counter()
+    table = table_name(f)
+    bounds = RANGES.get(table, {})
+    columns = {}
+    seen_ids = SeenIds()
+    rows = duplicated_id = 0
+    head = None
+    for df in iter_table(f, chunksize):
+        if head is None:
+            head = df.head()
+        rows += len(df)
+        for col in df.columns:
+            if col not in columns:
+                columns[col] = ColumnProfile(df[col].dtype)
+            columns[col].update(df[col], bounds.get(col))
+        if "id" in df.columns:
+            duplicated_id += int((~seen_ids.first_seen(df["id"])).sum())
 
-def check_logic_issues(df, filename):
     logic_issues = {}
-
     # Check if certain price-related columns have zero values
-    if "lowest_price" in df.columns:
-        logic_issues["lowest_price_is_zero"] = (df["lowest_price"] == 0).sum()
-    if "highest_price" in df.columns:
-        logic_issues["highest_price_is_zero"] = (df["highest_price"] == 0).sum()
-    if "price" in df.columns:
-        logic_issues["price_is_zero"] = (df["price"] == 0).sum()
-
+    for col in ["lowest_price", "highest_price", "price"]:
+        if col in columns:
+            logic_issues[f"{col}_is_zero"] = columns[col].zeros
     # Check for duplicate IDs
-    if "id" in df.columns:
-        logic_issues["duplicated_id"] = df["id"].duplicated().sum()
+    if "id" in columns:
+        logic_issues["duplicated_id"] = duplicated_id
 
-    return logic_issues
+    report = {
+        "file": f,
+        "table": table,
+        "rows": rows,
+        "columns": {col: p.to_dict() for col, p in columns.items()},
+        "logic_issues": logic_issues,
+        "runtime": time.perf_counter() - startTime,
+    }
+    return report, head
 
 
 if __name__ == "__main__":
     args = get_parser().parse_args()
     print("configs =", args)
 
-    for f in glob.glob(os.path.join(args.path, "*.csv")):
-        print(f"\nFound file {f}, printing head:")
-        df = pd.read_csv(f)
-        print(df.head(), "\n")
+    files = glob.glob(os.path.join(args.path, "*.csv"))
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(profile_file, files, [args.chunksize] * len(files)))
+    else:
+        results = [profile_file(f, args.chunksize) for f in files]
+
+    for report, head in results:
+        print(f"\nFound file {report['file']}, printing head:")
+        print(head, "\n")
 
         print("Missing values per column:")
-        missing = count_missing_values(df)
-        print(missing, "\n")
+        print(pd.Series({col: c["missing"] for col, c in report["columns"].items()}), "\n")
 
         print("Logic-based issues (e.g., 0 prices or duplicated IDs):")
-        logic = check_logic_issues(df, f)
-        for k, v in logic.items():
+        for k, v in report["logic_issues"].items():
             print(f"{k}: {v}")
 
         print("-" * 50)
 
-        # Write all profiling results to a report file
-        with open("profiling_report.txt", "a") as f_out:
-            f_out.write(f"\nFile: {f}\n")
-            f_out.write("Missing values:\n")
-            f_out.write(str(missing) + "\n")
-            f_out.write("Logic-based issues:\n")
-            for k, v in logic.items():
-                f_out.write(f"{k}: {v}\n")
-            f_out.write("-" * 50 + "\n")
+    # Write all profiling results to a report file
+    with open(args.output, "w") as f_out:
+        json.dump([report for report, _ in results], f_out, indent=2, default=str)
+    print(f"Saved profiling report to {args.output}")
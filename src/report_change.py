@@ -1,42 +1,163 @@
 import argparse
 import glob
+import numpy as np
 import os
 import pandas as pd
+import sys
+import tempfile
 
-from test import get_logger
+from cache import iter_table, read_table
+from logs import get_logger
 
-def get_change(dirty_df, clean_df):
-    # Set 'id' as the index for easy comparison
-    dirty_df.set_index('id', inplace=True)
-    clean_df.set_index('id', inplace=True)
+# Key of a missing id: rows without an id are matched as one more id, the way the
+# index alignment of the original get_change matched NaN with NaN, sorted last like NaN
+_MISSING_ID = np.inf
 
-    # Find common ids (present in both dirty and clean data)
-    common_ids = dirty_df.index.intersection(clean_df.index)
+def _id_keys(ids):
+    # Float keys of an id column, exact for every id below 2**53
+    return pd.Series(ids).to_numpy(dtype=np.float64, na_value=_MISSING_ID)
 
-    # Find removed ids (present in dirty, not in clean)
-    removed_ids = dirty_df.index.difference(clean_df.index)
+def _id_index(keys):
+    # Removed id keys back as an Index, int64 unless one of them is the missing id
+    if (keys == _MISSING_ID).any():
+        return pd.Index(np.where(keys == _MISSING_ID, np.nan, keys), name='id')
+    return pd.Index(keys.astype(np.int64), name='id')
 
-    # Subset dataframes to common ids for cell comparison
-    dirty_common = dirty_df.loc[common_ids].sort_index()
-    clean_common = clean_df.loc[common_ids].sort_index()
+def _first_rows(ids):
+    # Sorted unique ids and the row of each id's first occurrence
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    first = np.ones(len(sorted_ids), dtype=bool)
+    first[1:] = sorted_ids[1:] != sorted_ids[:-1]
+    return sorted_ids[first], order[first]
 
-    # Boolean DataFrame of cell-level changes
-    changes = dirty_common != clean_common
+def _align(dirty_ids, clean_ids):
+    # Rows of the ids present in both frames, in id order, plus the removed ids
+    dirty_sorted, dirty_rows = _first_rows(dirty_ids)
+    clean_sorted, clean_rows = _first_rows(clean_ids)
+    common, dirty_idx, clean_idx = np.intersect1d(dirty_sorted, clean_sorted, assume_unique=True, return_indices=True)
+    removed_ids = np.setdiff1d(dirty_sorted, clean_sorted, assume_unique=True)
+    return dirty_rows[dirty_idx], clean_rows[clean_idx], removed_ids
 
-    # Count cell changes only in common rows
-    total_changed_cells = changes.sum().sum()
+def _equal(a, b):
+    # Cell equality where two missing values are equal
+    try:
+        eq = (a == b)
+    except TypeError:
+        eq = (a.astype(object) == b.astype(object))
+    eq = eq.fillna(False).to_numpy(dtype=bool) if hasattr(eq, 'fillna') else np.asarray(eq, dtype=bool)
+    return eq | (a.isna().to_numpy() & b.isna().to_numpy())
+
+def _cell_changes(dirty_df, clean_df, columns):
+    # Per-column changed cell counts and changed row count of two aligned frames,
+    # rows with equal hashes are skipped before comparing column by column
+    dirty_hash = pd.util.hash_pandas_object(dirty_df, index=False).to_numpy()
+    clean_hash = pd.util.hash_pandas_object(clean_df, index=False).to_numpy()
+    candidates = np.flatnonzero(dirty_hash != clean_hash)
+    changed = np.zeros((len(candidates), len(columns)), dtype=bool)
+    if len(candidates):
+        dirty_cand = dirty_df.iloc[candidates]
+        clean_cand = clean_df.iloc[candidates]
+        for i, col in enumerate(columns):
+            changed[:, i] = ~_equal(dirty_cand[col].reset_index(drop=True), clean_cand[col].reset_index(drop=True))
+    return changed.sum(axis=0), int(changed.any(axis=1).sum())
 
-    # Count rows with changes in common rows
-    rows_with_cell_changes = changes.any(axis=1).sum()
+def get_change(dirty_df, clean_df, chunksize=None):
+    # Compare rows by id: missing values on both sides are not a change, and
+    # a duplicated id is compared by its first row
+    columns = [col for col in dirty_df.columns if col != 'id' and col in clean_df.columns]
+    dirty_rows, clean_rows, removed_ids = _align(_id_keys(dirty_df['id']), _id_keys(clean_df['id']))
 
+    column_counts = np.zeros(len(columns), dtype=np.int64)
+    rows_with_cell_changes = 0
+    chunksize = chunksize or max(len(dirty_rows), 1)
+    # id ranges of chunksize common ids, only one chunk of both frames is copied at a time
+    for start in range(0, len(dirty_rows), chunksize):
+        stop = start + chunksize
+        counts, rows = _cell_changes(
+            dirty_df[columns].take(dirty_rows[start:stop]),
+            clean_df[columns].take(clean_rows[start:stop]),
+            columns,
+        )
+        column_counts += counts
+        rows_with_cell_changes += rows
+
+    column_change_counts = pd.Series(column_counts, index=columns)
+    # Count cell changes only in common rows
+    total_changed_cells = int(column_counts.sum())
     # Add count of removed rows to total changed rows
     total_changed_rows = rows_with_cell_changes + len(removed_ids)
-
-    # Count per-column cell changes
-    column_change_counts = changes.sum()
+    removed_ids = _id_index(removed_ids)
 
     return total_changed_cells, total_changed_rows, rows_with_cell_changes, removed_ids, column_change_counts
 
+def _missing_id_rows(f, chunksize, cache_dir=None):
+    # The rows of f without an id, read in chunks
+    return pd.concat(df[df['id'].isna()] for df in iter_table(f, chunksize, cache_dir=cache_dir))
+
+def get_change_files(dirty_f, clean_f, chunksize):
+    # get_change over files in id ranges of chunksize ids, only the id columns
+    # and one range of rows are in memory at a time. The parquet copy of the
+    # cleaned file goes to a temporary folder, not next to the next run's output
+    with tempfile.TemporaryDirectory() as clean_cache:
+        return _get_change_files(dirty_f, clean_f, chunksize, clean_cache)
+
+def _get_change_files(dirty_f, clean_f, chunksize, clean_cache):
+    dirty_ids = _id_keys(read_table(dirty_f, columns=['id'])['id'])
+    clean_ids = _id_keys(read_table(clean_f, columns=['id'], cache_dir=clean_cache)['id'])
+    common = np.intersect1d(dirty_ids, clean_ids)
+    removed_ids = np.setdiff1d(dirty_ids, clean_ids)
+    del dirty_ids, clean_ids
+
+    column_change_counts = None
+    rows_with_cell_changes = 0
+    if (len(common) and common[-1] == _MISSING_ID):
+        # id range filters never match a missing id, compare those rows on their own
+        common = common[:-1]
+        dirty_df, clean_df = _missing_id_rows(dirty_f, chunksize), _missing_id_rows(clean_f, chunksize, clean_cache)
+        _, _, rows_with_cell_changes, _, column_change_counts = get_change(dirty_df, clean_df)
+    for start in range(0, len(common), chunksize):
+        lo, hi = int(common[start]), int(common[min(start + chunksize, len(common)) - 1])
+        id_range = [('id', '>=', lo), ('id', '<=', hi)]
+        dirty_df = read_table(dirty_f, filters=id_range)
+        clean_df = read_table(clean_f, filters=id_range, cache_dir=clean_cache)
+        # removed ids in the range are ignored here, they are counted once above
+        _, _, rows, _, counts = get_change(dirty_df, clean_df)
+        column_change_counts = counts if column_change_counts is None else column_change_counts + counts
+        rows_with_cell_changes += rows
+
+    if column_change_counts is None:
+        columns = [col for col in read_table(dirty_f, columns=None).columns if col != 'id']
+        column_change_counts = pd.Series(0, index=columns, dtype=np.int64)
+    total_changed_cells = int(column_change_counts.sum())
+    total_changed_rows = rows_with_cell_changes + len(removed_ids)
+    return total_changed_cells, total_changed_rows, rows_with_cell_changes, _id_index(removed_ids), column_change_counts
+
+def self_check():
+    # get_change and get_change_files on tables with missing ids: a missing id is
+    # matched with the other side's missing id, or counted as removed
+    dirty = pd.DataFrame({'id': [1, 2, None, 4], 'a': [10, 20, 30, 40], 'b': ['x', 'y', 'z', 'w']})
+    cases = {
+        'missing id on both sides': (pd.DataFrame({'id': [1, None, 4], 'a': [10, 31, 41], 'b': ['x', 'z', 'w']}), 3, 2, [2.0]),
+        'missing id removed': (pd.DataFrame({'id': [1, 4], 'a': [10, 41], 'b': ['x', 'w']}), 3, 1, [2.0, np.nan]),
+    }
+    failures = 0
+    with tempfile.TemporaryDirectory() as folder:
+        dirty_f = os.path.join(folder, 'Table.csv')
+        dirty.to_csv(dirty_f, index=False)
+        for name, (clean, rows, cells, removed) in cases.items():
+            clean_f = os.path.join(folder, 'cleaned_Table.csv')
+            clean.to_csv(clean_f, index=False)
+            results = {
+                'get_change': get_change(pd.read_csv(dirty_f), pd.read_csv(clean_f)),
+                'get_change_files': get_change_files(dirty_f, clean_f, 1),
+            }
+            for fn, (total_cells, total_rows, _, removed_ids, _) in results.items():
+                ok = (total_rows, total_cells) == (rows, cells) and removed_ids.astype(float).equals(pd.Index(removed, name='id'))
+                failures += not ok
+                print(f'{fn}, {name}: {"PASS" if ok else "FAIL"} ({total_rows} rows, {total_cells} cells, removed {list(removed_ids)})')
+    return failures == 0
+
 def get_parser():
     # Set up command-line argument parsing
     parser = argparse.ArgumentParser(description='options for reporting changes')
@@ -58,11 +179,24 @@ def get_parser():
         type=str,
         default='.', 
     )
+    parser.add_argument(
+        '--chunksize',
+        help='compare files in ranges of this many ids instead of loading them whole',
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        '--self-check',
+        action='store_true',
+        help='compare small tables with missing ids through both code paths and exit',
+    )
     return parser
 
 if __name__=='__main__':
     args = get_parser().parse_args()
     print('Configs =', args)
+    if args.self_check:
+        sys.exit(0 if self_check() else 1)
     
     # make output folder
     os.makedirs(args.outdir, exist_ok=True)
@@ -71,14 +205,16 @@ if __name__=='__main__':
 
     for clean_f in glob.glob(os.path.join(args.cleandir, '*.csv')):
         fn = os.path.basename(clean_f)
-        dirty_f = os.path.join(args.dirtydir, fn)
+        # clean.py writes cleaned_{file_name}
+        dirty_f = os.path.join(args.dirtydir, fn[len('cleaned_'):] if fn.startswith('cleaned_') else fn)
         if (os.path.isfile(dirty_f)):
-            # print(clean_f, dirty_f)
-            # continue
-            # Load the dirty and cleaned data files
-            dirty_df = pd.read_csv(dirty_f)
-            clean_df = pd.read_csv(clean_f)
-            total_changed_cells, total_changed_rows, rows_with_cell_changes, removed_ids, column_change_counts = get_change(dirty_df, clean_df)
+            if args.chunksize:
+                total_changed_cells, total_changed_rows, rows_with_cell_changes, removed_ids, column_change_counts = get_change_files(dirty_f, clean_f, args.chunksize)
+            else:
+                # Load the dirty and cleaned data files
+                dirty_df = read_table(dirty_f)
+                clean_df = read_table(clean_f, use_cache=False)
+                total_changed_cells, total_changed_rows, rows_with_cell_changes, removed_ids, column_change_counts = get_change(dirty_df, clean_df)
             logger.info('='*70, extra={'simple': True})
             logger.info(f'Filename: {fn}', extra={'simple': True})
             # Display the results
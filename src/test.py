@@ -1,36 +1,37 @@
 import argparse
 import glob
-import logging
+import json
 import numpy as np
 import os
 import pandas as pd
 # import pytest
+import queue
+import threading
 import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
+from cache import iter_table, row_count
+from clean import SeenIds
+from dates import parse_timestamps
+from manifest import file_stat
+
+from logs import RED, GREEN, RESET, get_logger
 from tests import (
-    ENGINE, 
-    RED,
-    GREEN, 
-    RESET,
+    POOL_SIZE,
     TABLE_MAP,
     TEST_GROUPS,
     LoggerTestRunner, 
-    ConditionalFormatter,
+    DB_URL,
+    SQLTestCase,
+    configure_engine,
+    create_indexes,
+    get_engine,
 )
 
-def get_logger(fn='test.log'):
-    console_handler = logging.StreamHandler()
-    console_formatter = ConditionalFormatter('%(levelname)s - %(message)s')
-    console_handler.setFormatter(console_formatter)
-    file_handler = logging.FileHandler(fn)
-    file_formatter = ConditionalFormatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(file_formatter)
-    logging.basicConfig(level=logging.DEBUG, handlers=[console_handler, file_handler])
-
-    logger = logging.getLogger(__name__)
-    return logger
+# Set on Ctrl-C, the table loads stop after the chunks they are writing
+STOP = threading.Event()
 
 def get_parser():
     # Set up command-line argument parsing
@@ -47,12 +48,35 @@ def get_parser():
         type=str,
         default='.', 
     )
+    parser.add_argument(
+        '--db-url',
+        help=f'SQLAlchemy URL of the database, e.g. sqlite:///nypl.db (default: NYPL_DB_URL or {DB_URL})',
+        type=str,
+        default=None,
+    )
     parser.add_argument(
         '--reset',
         nargs='*',
         metavar='TABLE',
         help=f'Reset tables and insert data, options: {list(TABLE_MAP.keys())}',
     )
+    parser.add_argument(
+        '--writers',
+        help=f'insert threads per table when resetting, tables load concurrently while the connection pool ({POOL_SIZE}) allows',
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        '--queue-depth',
+        help='parsed chunks each table may hold waiting for a writer, caps the memory of a reset',
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='with --reset, continue the tables with a checkpoint from their last committed chunk instead of dropping them',
+    )
     parser.add_argument(
         '--tests',
         nargs='*',
@@ -60,25 +84,75 @@ def get_parser():
         help=f'Specify which test groups to run, options: {['all']+list(TEST_GROUPS.keys())}',
         default=[],
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        help=f'number of test classes to run concurrently, at most the connection pool size ({POOL_SIZE}, NYPL_DB_POOL_SIZE)',
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        '--count-only',
+        action='store_true',
+        help='only count violating rows, faster but no *_FailedID.json is written',
+    )
+    parser.add_argument(
+        '--fused',
+        action='store_true',
+        help='run the row level checks of every table as one fused scan instead of one query per method',
+    )
+    parser.add_argument(
+        '--explain',
+        action='store_true',
+        help='run EXPLAIN on every distinct query and report full table scans in queries_*.json',
+    )
+    parser.add_argument(
+        '--chunksize',
+        help='number of rows sent per insert batch when resetting tables',
+        type=int,
+        default=5000,
+    )
     return parser
 
-def load_selected_tests(selected_groups, output_dir='.', logger=None):
-    suite = unittest.TestSuite()
-    loader = unittest.TestLoader()
+def load_selected_classes(selected_groups, output_dir='.', logger=None):
     if ('all' in selected_groups):  # load all
         selected_groups = TEST_GROUPS.keys()
 
+    classes = []
     for group in selected_groups:
         test_classes = TEST_GROUPS.get(group, [])
         for test_class in test_classes:
             if logger:
                 logger.debug(f'Loading tests from: {test_class.__name__}')
-            # suite.addTest(test_class())
             test_class.output_dir = output_dir
-            suite.addTest(loader.loadTestsFromTestCase(test_class))
+            classes.append(test_class)
+    return classes
+
+def load_selected_tests(selected_groups, output_dir='.', logger=None):
+    suite = unittest.TestSuite()
+    loader = unittest.TestLoader()
+    for test_class in load_selected_classes(selected_groups, output_dir, logger):
+        # suite.addTest(test_class())
+        suite.addTest(loader.loadTestsFromTestCase(test_class))
 
     return suite
 
+def run_parallel(test_classes, runner, jobs):
+    # The checks are read only, so test classes run on their own threads and
+    # only share the engine's connection pool; results merge into one summary
+    loader = unittest.TestLoader()
+
+    def run_class(test_class):
+        result = runner._makeResult()
+        result.qualified = True
+        loader.loadTestsFromTestCase(test_class).run(result)
+        return result
+
+    merged = runner._makeResult()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for result in executor.map(run_class, test_classes):
+            merged.merge(result)
+    return merged
+
 def load_pytest_args(selected_groups, logger=None):
     if ('all' in selected_groups):  # load all
         return list(TEST_GROUPS.values())
@@ -91,31 +165,220 @@ def load_pytest_args(selected_groups, logger=None):
         args += test_fn
     return args
 
-def insert_data(f, engine, output_dir='.', logger=None):
-    df = pd.read_csv(f)
+def insert_rows(df, table_name, engine, start, stop, failed_rows, logger=None):
+    # Insert rows [start, stop) as one multi-row transaction, on failure bisect
+    # the batch until the offending rows are isolated
+    try:
+        with engine.begin() as conn:
+            df.iloc[start:stop].to_sql(table_name, con=conn, if_exists='append', index=False)
+    except Exception as e:
+        if (stop - start == 1):
+            # chunks keep the row numbers of the whole file as their index
+            row = int(df.index[start])
+            logger.error(f'Failed to insert row {row} - Error: {e}')
+            failed_rows.append(row)
+            return
+        mid = (start + stop) // 2
+        insert_rows(df, table_name, engine, start, mid, failed_rows, logger)
+        insert_rows(df, table_name, engine, mid, stop, failed_rows, logger)
+
+def checkpoint_path(output_dir, table_name):
+    return os.path.join(output_dir, f'{table_name}_checkpoint.json')
+
+def save_checkpoint(output_dir, table_name, checkpoint):
+    # Written to a temporary file and renamed, a crash leaves either the old or the new one
+    path = checkpoint_path(output_dir, table_name)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f'{path}.tmp', path)
+
+def load_checkpoint(f, output_dir='.', chunksize=5000):
+    # Checkpoint of the last insert of csv f, None when there is none or it was
+    # written for another version of the file or another chunksize
     table_name = os.path.splitext(os.path.basename(f))[0]
-    failed_rows = []
-    logger.info(f'Start inserting into {table_name}')
+    try:
+        with open(checkpoint_path(output_dir, table_name)) as cf:
+            checkpoint = json.load(cf)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if (checkpoint.get('source') != file_stat(f) or checkpoint.get('chunksize') != chunksize):
+        return None
+    return checkpoint
+
+def delete_replayed(ids, table_name, engine, batch=1000):
+    # insert_rows commits every bisected half and the writers commit chunks out of
+    # order, so the rows an interrupted run was writing past its checkpoint may be
+    # partly committed: delete their ids so the replay inserts each exactly once.
+    # ids holds none of the ids committed before the checkpoint
+    ids = np.unique(ids.to_numpy(dtype=float, na_value=np.nan))
+    ids = ids[~np.isnan(ids)].astype(np.int64).tolist()
+    table = TABLE_MAP[table_name].__table__
+    with engine.begin() as conn:
+        for i in range(0, len(ids), batch):
+            conn.execute(table.delete().where(table.c.id.in_(ids[i:i + batch])))
+    return len(ids)
+
+def _put(chunks, item, writers):
+    # Blocks while the queue is full, a writer that stopped early has failed
+    while True:
+        try:
+            chunks.put(item, timeout=1)
+            return
+        except queue.Full:
+            for writer in writers:
+                if writer.done():
+                    writer.result()
+                    raise RuntimeError('insert writer stopped early')
+
+def _parse_timestamps(df):
     # Preprocess datetime columns: strip " UTC" and parse
     for col in ['created_at', 'updated_at']:
         if col in df.columns:
-            df[col] = pd.to_datetime(df[col].str.replace(' UTC', '', regex=False), errors='coerce')
-    for idx, row in tqdm(df.iterrows(), total=df.shape[0]):
+            df[col] = parse_timestamps(df[col])
+    return df
+
+def insert_data(f, engine, output_dir='.', logger=None, chunksize=5000, resume=False, writers=1, queue_depth=4, position=0):
+    # The calling thread streams parsed chunks into a queue of at most queue_depth
+    # chunks, writers threads insert them through their own pooled connections. After
+    # every committed chunk {table}_checkpoint.json records the rows up to which every
+    # chunk is committed (and the failed rows among them), resume continues from there.
+    # Returns the rows inserted by this call and the failed rows of the whole file
+    table_name = os.path.splitext(os.path.basename(f))[0]
+    columns = [col.name for col in TABLE_MAP[table_name].__table__.columns]
+    rows = row_count(f)  # None until the csv is cached
+    checkpoint = load_checkpoint(f, output_dir, chunksize) if resume else None
+    first = checkpoint['committed'] if checkpoint else 0
+    if (checkpoint and rows is not None and first >= rows):
+        logger.info(f'{table_name} already inserted ({len(checkpoint["failed_rows"])} failed rows), skipping')
+        return 0, checkpoint['failed_rows']
+    # rows [first, high) may have been written before the interruption, they are held
+    # back until their ids are deleted
+    high = checkpoint.get('high', first + chunksize) if checkpoint else 0
+    prior_failed = checkpoint['failed_rows'] if checkpoint else []
+    logger.info(f'Start inserting into {table_name} (chunksize={chunksize}, writers={writers})')
+    source = file_stat(f)
+    state = {'committed': first, 'high': first, 'failed_rows': prior_failed}
+    done = {}  # start -> (stop, failed rows) of chunks committed past state['committed']
+    failed_frames = []  # the failed rows themselves, for the summary
+    committed = threading.Condition()
+    broken = threading.Event()
+    chunks = queue.Queue(maxsize=queue_depth)
+    pbar = tqdm(total=rows, initial=first, desc=table_name, position=position)
+
+    def save():
+        # Writers take chunks in order and hold one at a time, so every chunk written
+        # so far ends before the last committed chunk plus one chunk per writer
+        save_checkpoint(output_dir, table_name, {
+            'source': source,
+            'chunksize': chunksize,
+            'committed': state['committed'],
+            'high': max(state['high'] + writers * chunksize, high),
+            'failed_rows': state['failed_rows'],
+        })
+
+    def commit(start, stop, failed_rows, failed_df):
+        # advance the checkpoint over every chunk committed with no gap before it
+        with committed:
+            done[start] = (stop, failed_rows)
+            failed_frames.append(failed_df)
+            state['high'] = max(state['high'], stop)
+            while state['committed'] in done:
+                end, chunk_failed = done.pop(state['committed'])
+                state['failed_rows'] = state['failed_rows'] + chunk_failed
+                state['committed'] = end
+            save()
+            committed.notify_all()
+
+    def write():
         try:
-            # Convert row to a DataFrame for to_sql
-            pd.DataFrame([row]).to_sql(table_name, con=engine, if_exists='append', index=False)
-        except KeyboardInterrupt:
-            logger.error(f'User interrupted at row {idx}')
-            np.save(os.path.join(output_dir, f'{table_name}_failed.npy'), np.array(failed_rows))
-            exit()
-        except Exception as e:
-            logger.error(f'Failed to insert row {idx} - Error: {e}')
-            failed_rows.append(idx)
+            while True:
+                item = chunks.get()
+                if (item is None):
+                    return
+                df, late = item
+                start, stop = int(df.index[0]), int(df.index[-1]) + 1
+                failed_rows = []
+                # Send the whole chunk through executemany in a single transaction
+                insert_rows(df[~late], table_name, engine, 0, int((~late).sum()), failed_rows, logger)
+                if (late.any()):
+                    with committed:
+                        committed.wait_for(lambda: state['committed'] >= start or broken.is_set())
+                    if (broken.is_set()):
+                        return
+                    insert_rows(df[late], table_name, engine, 0, int(late.sum()), failed_rows, logger)
+                failed_rows.sort()
+                commit(start, stop, failed_rows, df.loc[failed_rows] if failed_rows else None)
+                pbar.update(stop - start)
+        except BaseException:
+            # writers waiting on this chunk would wait forever
+            broken.set()
+            with committed:
+                committed.notify_all()
+            raise
+
+    # A row repeating the id of a row in an earlier chunk waits for that chunk, so the
+    # first row of every id wins the primary key as in a serial load
+    seen_ids = SeenIds()
+    held, replayed_ids = [], []
+    # before the first write, so an interruption before any commit is resumed too
+    save()
+    startTime = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        futures = [executor.submit(write) for _ in range(writers)]
+
+        def release():
+            if (replayed_ids):
+                deleted = delete_replayed(pd.concat(replayed_ids), table_name, engine)
+                logger.info(f'Resuming {table_name} at row {first}, cleared {deleted} ids of the interrupted chunks')
+                replayed_ids.clear()
+            for item in held:
+                _put(chunks, item, futures)
+            held.clear()
+
+        try:
+            for df in iter_table(f, chunksize, columns=columns):
+                if (STOP.is_set()):
+                    break
+                ids = df['id']
+                first_seen = seen_ids.first_seen(ids)
+                late = (~ids.isin(ids[first_seen]) & ids.notna()).to_numpy()
+                if (prior_failed and df.index[0] < first):
+                    failed_frames.append(_parse_timestamps(df[df.index.isin(prior_failed)]))
+                resumed = df.index >= first
+                if (not resumed.any()):
+                    continue
+                df, late, first_seen = _parse_timestamps(df[resumed]), late[resumed], first_seen[resumed]
+                if (df.index[0] < high):
+                    # ids first seen past the checkpoint were not committed before it
+                    replayed_ids.append(df['id'][first_seen & (df.index < high)])
+                    held.append((df, late))
+                    if (df.index[-1] + 1 >= high):
+                        release()
+                    continue
+                _put(chunks, (df, late), futures)
+            release()
+        finally:
+            for _ in futures:
+                _put(chunks, None, futures)
+        for future in futures:
+            future.result()
+    pbar.close()
+    timeTaken = time.perf_counter() - startTime
+    # rows that reached the table: the ones processed by this call minus its failed rows
+    inserted = state['committed'] - first - (len(state['failed_rows']) - len(prior_failed))
+    if (STOP.is_set()):
+        logger.error(f'Interrupted {table_name} at row {state["committed"]}, continue with --reset {table_name} --resume')
+        return inserted, state['failed_rows']
+    logger.info(f'Inserted {inserted} rows into {table_name} in {timeTaken:.2f}s ({inserted / timeTaken:.0f} rows/s)')
 
+    failed_rows = state['failed_rows']
     if failed_rows:
+        np.save(os.path.join(output_dir, f'{table_name}_failed.npy'), np.array(failed_rows))
         logger.info(f'\n Summary of {len(failed_rows)} failed rows for table "{table_name}":')
-        logger.info(df.iloc[failed_rows])
-    return df, failed_rows
+        logger.info(pd.concat(failed_frames).sort_index())
+    return inserted, failed_rows
 
 if __name__ == "__main__":
     args = get_parser().parse_args()
@@ -125,36 +388,96 @@ if __name__ == "__main__":
     os.makedirs(args.outdir, exist_ok=True)
     assert os.path.isdir(args.outdir), f'output path does not exist or is not directory: {args.outdir}'
     logger = get_logger(os.path.join(args.outdir, 'test.log'))
+    if (args.db_url):
+        configure_engine(args.db_url)
 
     # table create/drop/insert logic
     if (args.reset is not None):
         reset_tables = args.reset if args.reset else TABLE_MAP.keys()
+        engine = get_engine()
         logger.info(f'Resetting tables: {list(reset_tables)}')
         # Reflect base metadata for partial drop
         for table in reset_tables:
             model = TABLE_MAP.get(table)
-            if (model):
+            if (model and args.resume and load_checkpoint(os.path.join(args.path, f'{table}.csv'), args.outdir, args.chunksize)):
+                logger.info(f'Keeping table "{table}", resuming from its checkpoint')
+            elif (model):
                 logger.info(f'Dropping and creating table "{table}"')
-                model.__table__.drop(ENGINE, checkfirst=True)
-                model.__table__.create(ENGINE, checkfirst=True)
+                if os.path.exists(checkpoint_path(args.outdir, table)):
+                    os.remove(checkpoint_path(args.outdir, table))
+                model.__table__.drop(engine, checkfirst=True)
+                model.__table__.create(engine, checkfirst=True)
             else:
                 logger.warning(f'Unknown table: {table}, skipping...')
         # Insert data only for reset tables
-        for f in glob.glob(os.path.join(args.path, "*.csv")):
-            table_name = os.path.splitext(os.path.basename(f))[0]
-            if (table_name in reset_tables):
-                insert_data(f, ENGINE, args.outdir, logger)
+        files = [f for f in sorted(glob.glob(os.path.join(args.path, "*.csv")))
+                 if os.path.splitext(os.path.basename(f))[0] in reset_tables]
+        # every writer holds a pooled connection, as many tables load at once as the pool allows
+        writers = max(1, min(args.writers, POOL_SIZE))
+        tables = max(1, min(len(files), POOL_SIZE // writers))
+        if (engine.dialect.name == 'sqlite'):
+            # SQLite takes one writer at a time, the others would fail on its lock
+            writers = tables = 1
+        if (writers < args.writers):
+            logger.warning(f'--writers {args.writers} exceeds what the database allows, using {writers}')
+        startTime = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=tables) as executor:
+            futures = {
+                executor.submit(insert_data, f, engine, args.outdir, logger, args.chunksize, args.resume, writers, args.queue_depth, i): f
+                for i, f in enumerate(files)
+            }
+            try:
+                inserted = sum(future.result()[0] for future in as_completed(futures))
+            except KeyboardInterrupt:
+                STOP.set()
+                logger.error('Interrupted, committed chunks are in the checkpoints, continue with --resume')
+                executor.shutdown(wait=True)
+                exit()
+        timeTaken = time.perf_counter() - startTime
+        logger.info(f'Inserted {inserted} rows into {len(files)} tables in {timeTaken:.2f}s ({inserted / timeTaken:.0f} rows/s, {tables} tables at a time, {writers} writers each)')
+        # secondary indexes are built once over the loaded rows, not per insert
+        for table in reset_tables:
+            model = TABLE_MAP.get(table)
+            if (model):
+                startTime = time.perf_counter()
+                built = create_indexes(model, engine)
+                if (built):
+                    logger.info(f'Built indexes {built} on "{table}" in {time.perf_counter() - startTime:.2f}s')
     
-    if (len(args.tests)>0):
+    if (len(args.tests)>0 and args.fused):
+        from tests import Session
+        from tests.rules import run_fused
+        get_engine()  # binds Session
+        class_names = [c.__name__ for c in load_selected_classes(args.tests, args.outdir, logger)]
+        startTime = time.perf_counter()
+        with Session() as session:
+            results = run_fused(session, class_names, args.outdir, logger)
+        passed = list(results.values())
+        logger.info('        Final Result')
+        logger.info('='*70, extra={'simple': True})
+        logger.info(f'Tests run: {len(passed)}')
+        logger.info(f'Success: {GREEN}{passed.count(True)}{RESET}')
+        logger.info(f'Failure: {RED}{passed.count(False)}{RESET}')
+        logger.info(f'Errors: {RED}{passed.count(None)}{RESET}')
+        logger.info(f'Total Runtime: {time.perf_counter() - startTime:.4f}s')
+        logger.info('='*70, extra={'simple': True})
+    elif (len(args.tests)>0):
         # loading testcases
-        suite = load_selected_tests(args.tests, args.outdir)
+        SQLTestCase.count_only = args.count_only
+        SQLTestCase.explain = args.explain
+        jobs = min(args.jobs, POOL_SIZE)
+        if (jobs < args.jobs):
+            logger.warning(f'--jobs {args.jobs} exceeds the connection pool, running {jobs} at a time')
         runner = LoggerTestRunner(logger, verbosity=2)
         logger.info('        Starting Test')
         logger.info('='*60, extra={'simple': True})
         startTime = time.perf_counter()
         # pytest_args = ['-v', '-s'] + load_pytest_args(args.tests)
         try:
-            result = runner.run(suite)
+            if (jobs > 1):
+                result = run_parallel(load_selected_classes(args.tests, args.outdir), runner, jobs)
+            else:
+                result = runner.run(load_selected_tests(args.tests, args.outdir))
             # result = pytest.main(pytest_args)
         except KeyboardInterrupt:
             logger.warning('Test run interrupted by KeyboardInterrupt')
@@ -0,0 +1,137 @@
+import json
+import os
+import time
+
+import numpy as np
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.orm import aliased
+
+from .test_base import FETCH_BATCH, GREEN, RED, RESET, Dish, Menu, MenuItem, MenuPage
+
+# The row level checks of the test classes as (table, test class, test method,
+# condition, outer joins) rules: a row fails the method when condition is true.
+# fused_scan runs all rules of a table as one SELECT, so a suite costs one scan
+# per table instead of one or two per method
+
+
+def _range(column, lower, upper=None):
+    if upper is None:
+        return column < lower
+    return or_(column < lower, column > upper)
+
+
+def _missing(column, parent):
+    # Foreign key check: outer join the parent rows, flagged when there is none
+    ref = aliased(parent)
+    return ref.id.is_(None), [(ref, column == ref.id)]
+
+
+def _duplicated(*columns):
+    # Rows whose values of columns occur more than once (NULLs never match)
+    groups = select(*columns).group_by(*columns).having(func.count(columns[0]) > 1).subquery()
+    onclause = and_(*(col == groups.c[col.key] for col in columns))
+    return groups.c[columns[0].key].is_not(None), [(groups, onclause)]
+
+
+def _rule(model, class_name, method, condition, joins=()):
+    return (model, class_name, method, condition, list(joins))
+
+
+_STR_DATE = func.str_to_date(Menu.date, '%Y-%m-%d')
+
+RULES = [
+    _rule(Dish, 'TestDishYearValid', 'test_first_appeared', _range(Dish.first_appeared, 1500, 2025)),
+    _rule(Dish, 'TestDishYearValid', 'test_last_appeared', _range(Dish.last_appeared, 1500, 2025)),
+    _rule(Dish, 'TestDisPriceValid', 'test_lowest_price', _range(Dish.lowest_price, 0)),
+    _rule(Dish, 'TestDisPriceValid', 'test_highest_price', _range(Dish.highest_price, 0)),
+    _rule(Menu, 'TestMenuNumberValid', 'test_page_count', _range(Menu.page_count, 0)),
+    _rule(Menu, 'TestMenuNumberValid', 'test_dish_count', _range(Menu.dish_count, 0)),
+    # STR_TO_DATE and YEAR are MySQL functions, like in TestMenuDateValid
+    _rule(Menu, 'TestMenuDateValid', 'test_date_parseable', _STR_DATE.is_(None)),
+    _rule(Menu, 'TestMenuDateValid', 'test_date_valid', and_(_STR_DATE.is_not(None), func.year(_STR_DATE) > 2025)),
+    _rule(MenuPage, 'TestMenuPageNumberValid', 'test_page_number', _range(MenuPage.page_number, 0)),
+    _rule(MenuPage, 'TestMenuPageNumberValid', 'test_full_height', _range(MenuPage.full_height, 0)),
+    _rule(MenuPage, 'TestMenuPageNumberValid', 'test_full_width', _range(MenuPage.full_width, 0)),
+    _rule(MenuPage, 'TestMenuPageDuplicate', 'test_uuid', *_duplicated(MenuPage.uuid)),
+    _rule(MenuPage, 'TestMenuPageDuplicate', 'test_menu_id_page_number', *_duplicated(MenuPage.menu_id, MenuPage.page_number)),
+    _rule(MenuPage, 'TestTablesSchema', 'test_menu_page_menu_id_fk', *_missing(MenuPage.menu_id, Menu)),
+    _rule(MenuItem, 'TestMenuItemNumberValid', 'test_price', _range(MenuItem.price, 0)),
+    _rule(MenuItem, 'TestMenuItemNumberValid', 'test_high_price', _range(MenuItem.high_price, 0)),
+    _rule(MenuItem, 'TestMenuItemNumberValid', 'test_price_high_price', MenuItem.high_price < MenuItem.price),
+    _rule(MenuItem, 'TestMenuItemNumberValid', 'test_xpos', _range(MenuItem.xpos, 0, 1)),
+    _rule(MenuItem, 'TestMenuItemNumberValid', 'test_ypos', _range(MenuItem.ypos, 0, 1)),
+    _rule(MenuItem, 'TestMenuItemDateValid', 'test_create_update', MenuItem.created_at > MenuItem.updated_at),
+    _rule(MenuItem, 'TestTablesSchema', 'test_menu_item_dish_id_fk', *_missing(MenuItem.dish_id, Dish)),
+    _rule(MenuItem, 'TestTablesSchema', 'test_menu_item_menu_page_id_fk', *_missing(MenuItem.menu_page_id, MenuPage)),
+]
+# The checks that are not row level: TestTablesSchema's expected row counts
+ROW_COUNTS = [
+    (Dish, 'TestTablesSchema', 'test_dish', 423397),
+    (Menu, 'TestTablesSchema', 'test_menu', 17545),
+    (MenuPage, 'TestTablesSchema', 'test_menu_page', 66937),
+    (MenuItem, 'TestTablesSchema', 'test_menu_item', 1332726),
+]
+
+
+def fused_scan(session, model, rules):
+    # One SELECT id, CASE WHEN <condition> THEN 1 ELSE 0 END, ... over the table,
+    # fetching only rows that fail a rule. Returns the sorted failed ids per rule
+    stmt = select(model.id, *(case((rule[3], 1), else_=0) for rule in rules)).select_from(model)
+    for rule in rules:
+        for target, onclause in rule[4]:
+            stmt = stmt.outerjoin(target, onclause)
+    stmt = stmt.where(or_(*(rule[3] for rule in rules)))
+    result = session.execute(stmt, execution_options={'stream_results': True, 'yield_per': FETCH_BATCH})
+    batches = [np.array(rows, dtype=np.int64).reshape(-1, len(rules) + 1) for rows in result.partitions()]
+    rows = np.concatenate(batches) if batches else np.empty((0, len(rules) + 1), dtype=np.int64)
+    return [np.unique(rows[rows[:, i + 1] == 1, 0]) for i in range(len(rules))]
+
+
+def _scan_alone(session, model, rule, logger=None):
+    try:
+        return fused_scan(session, model, [rule])[0]
+    except Exception as e:
+        session.rollback()
+        if logger:
+            logger.error(f'{rule[1]}.{rule[2]} failed: {e}')
+        return None
+
+
+def run_fused(session, class_names, output_dir='.', logger=None):
+    # Run the selected test classes as one fused scan per table and write their
+    # {TestClass}_FailedID.json. Returns {(class, method): True/False, None on error}
+    failed_ids = {name: {} for name in class_names}
+    results = {}
+    by_table = {}
+    for rule in RULES:
+        if rule[1] in failed_ids:
+            by_table.setdefault(rule[0], []).append(rule)
+    for model, rules in by_table.items():
+        startTime = time.perf_counter()
+        try:
+            ids = fused_scan(session, model, rules)
+        except Exception as e:
+            session.rollback()
+            if logger:
+                logger.error(f'Fused scan of {model.__tablename__} failed, scanning per rule: {e}')
+            # a rule the database cannot run only fails itself
+            ids = [_scan_alone(session, model, rule, logger) for rule in rules]
+        for rule, rule_ids in zip(rules, ids):
+            failed_ids[rule[1]][rule[2]] = [] if rule_ids is None else rule_ids.tolist()
+            results[(rule[1], rule[2])] = None if rule_ids is None else len(rule_ids) == 0
+        if logger:
+            logger.info(f'Scanned {model.__tablename__} for {len(rules)} rules in {time.perf_counter() - startTime:.4f}s')
+    for model, class_name, method, expected in ROW_COUNTS:
+        if class_name in failed_ids:
+            rows = session.scalar(select(func.count()).select_from(model))
+            failed_ids[class_name][method] = []
+            results[(class_name, method)] = rows == expected
+    for (class_name, method), passed in sorted(results.items()):
+        if logger:
+            status = 'ERROR' if passed is None else 'PASS' if passed else 'FAIL'
+            color = GREEN if passed else RED
+            logger.info(f'{class_name}.{method}: {color}{status}{RESET} ({len(failed_ids[class_name][method])} failed ids)')
+    for class_name, methods in failed_ids.items():
+        with open(os.path.join(output_dir, f'{class_name}_FailedID.json'), 'w+') as f:
+            json.dump(dict(sorted(methods.items())), f)
+    return results
@@ -1,55 +1,49 @@
-from sqlalchemy import func
+from sqlalchemy import func, select
 
 from .test_base import SQLTestCase, MenuPage
 
 class TestMenuPageNumberValid(SQLTestCase):
     ### Check MenuPage.page_number has no negative values
     def test_page_number(self):
-        res1 = self.session.query(MenuPage).filter(MenuPage.page_number < 0).all()
-        self.assertEmpty(res1, 'Found MenuPage rows with page_number less than 0')
+        res1 = select(MenuPage.id).where(MenuPage.page_number < 0)
+        self.assertNoIds(res1, 'Found MenuPage rows with page_number less than 0')
 
     ### Check MenuPage.full_height has no negative values
     def test_full_height(self):
-        res1 = self.session.query(MenuPage).filter(MenuPage.full_height < 0).all()
-        self.assertEmpty(res1, 'Found MenuPage rows with full_height less than 0')
+        res1 = select(MenuPage.id).where(MenuPage.full_height < 0)
+        self.assertNoIds(res1, 'Found MenuPage rows with full_height less than 0')
 
     ### Check MenuPage.full_width has no negative values
     def test_full_width(self):
-        res1 = self.session.query(MenuPage).filter(MenuPage.full_width < 0).all()
-        self.assertEmpty(res1, 'Found MenuPage rows with full_width less than 0')
+        res1 = select(MenuPage.id).where(MenuPage.full_width < 0)
+        self.assertNoIds(res1, 'Found MenuPage rows with full_width less than 0')
 
 class TestMenuPageDuplicate(SQLTestCase):
     ### Check MenuPage.uuid has no duplicates
     def test_uuid(self):
         res1 = (
-            self.session.query(MenuPage.uuid)
+            select(MenuPage.uuid)
             .group_by(MenuPage.uuid)
             .having(func.count(MenuPage.uuid) > 1)
-            .subquery()
-        )
-        res2 = (
-            self.session.query(MenuPage)
-            .filter(MenuPage.uuid.in_(res1))
-            .all()
         )
+        res2 = select(MenuPage.id).where(MenuPage.uuid.in_(res1))
 
-        self.assertEmpty(res2, 'Found MenuPage rows with duplicated uuid')
+        self.assertNoIds(res2, 'Found MenuPage rows with duplicated uuid')
     
     ### Check MenuPage.page_number has no duplicates when linked to the same MenuPage.menu_id
     def test_menu_id_page_number(self):
         res1 = (
-            self.session.query(MenuPage.menu_id, MenuPage.page_number)
+            select(MenuPage.menu_id, MenuPage.page_number)
             .group_by(MenuPage.menu_id, MenuPage.page_number)
             .having(func.count('*') > 1)
             .subquery()
         )
         res2 = (
-            self.session.query(MenuPage)
+            select(MenuPage.id)
             .join(
                 res1,
                 (MenuPage.menu_id == res1.c.menu_id) &
                 (MenuPage.page_number == res1.c.page_number)
             )
-            .all()
         )
-        self.assertEmpty(res2, 'Found MenuPage rows with duplicated page_number within same Menu')
+        self.assertNoIds(res2, 'Found MenuPage rows with duplicated page_number within same Menu')
@@ -0,0 +1,139 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# Opt-in tracing of the clean.py stages: every stage records its wall time, rows
+# in and out, rows modified and resident memory delta as a Chrome trace event
+# (load the file in chrome://tracing or https://ui.perfetto.dev)
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_bytes():
+    # Resident set size from /proc/self/statm, None where there is no procfs
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Span:
+    # What one stage did to one table (or chunk), filled in by the stage
+    def __init__(self, rows_in):
+        self.rows_in = rows_in
+        self.rows_out = rows_in
+        self.rows_modified = 0
+
+    def keep(self, mask):
+        # rows the stage keeps
+        self.rows_out = int(mask.sum())
+
+    def output(self, rows):
+        self.rows_out = rows
+
+    def modified(self, mask):
+        # rows the stage changes in place
+        self.rows_modified += int(mask.sum())
+
+    def changed(self, before, after):
+        # rows whose value differs between the two series, two missing values are equal
+        self.rows_modified += int((~((before == after).fillna(False) | (before.isna() & after.isna()))).sum())
+
+
+class _NullSpan:
+    # Stand-in while tracing is off, so stages never pay for the counting
+    def keep(self, mask):
+        pass
+
+    def output(self, rows):
+        pass
+
+    def modified(self, mask):
+        pass
+
+    def changed(self, before, after):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+
+    @contextmanager
+    def stage(self, name, table, rows_in):
+        if not self.enabled:
+            yield _NULL_SPAN
+            return
+        span = Span(rows_in)
+        rss = rss_bytes()
+        # epoch time so events from worker processes line up
+        start = time.time_ns()
+        try:
+            yield span
+        finally:
+            end = time.time_ns()
+            end_rss = rss_bytes()
+            self.events.append({
+                'name': name,
+                'cat': 'clean',
+                'ph': 'X',
+                'ts': start / 1000,
+                'dur': (end - start) / 1000,
+                'pid': os.getpid(),
+                'args': {
+                    'table': table,
+                    'rows_in': span.rows_in,
+                    'rows_out': span.rows_out,
+                    'rows_modified': span.rows_modified,
+                    'rss_delta_bytes': None if rss is None or end_rss is None else end_rss - rss,
+                },
+            })
+
+    def drain(self):
+        events, self.events = self.events, []
+        return events
+
+
+TRACER = Tracer()
+
+
+def stage(name, table, rows_in):
+    return TRACER.stage(name, table, rows_in)
+
+
+def run_traced(func, *args):
+    # Run func with tracing on and hand back its events too, this is how events
+    # recorded in a worker process get back to the main process
+    TRACER.enabled = True
+    result = func(*args)
+    return result, TRACER.drain()
+
+
+def write_trace(path, events):
+    # Chrome trace file with one track per process and table
+    tids = {}
+    for event in events:
+        event['tid'] = tids.setdefault((event['pid'], event['args']['table']), len(tids) + 1)
+    metadata = [
+        {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': table}}
+        for (pid, table), tid in tids.items()
+    ]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f)
+
+
+def summarize(events):
+    # Total time and rows per (table, stage), slowest first
+    totals = {}
+    for event in events:
+        key = (event['args']['table'], event['name'])
+        total = totals.setdefault(key, {'ms': 0.0, 'rows_in': 0, 'rows_out': 0, 'rows_modified': 0})
+        total['ms'] += event['dur'] / 1000
+        for k in ('rows_in', 'rows_out', 'rows_modified'):
+            total[k] += event['args'][k]
+    return sorted(totals.items(), key=lambda item: item[1]['ms'], reverse=True)
@@ -0,0 +1,237 @@
+import argparse
+import json
+import numpy as np
+import os
+import pandas as pd
+import time
+
+from cache import read_table
+from dates import full_date_years, parse_timestamps
+from integrity import semi_join, sorted_ids
+from logs import get_logger
+
+# Same row counts TestTablesSchema expects from the database
+EXPECTED_ROWS = {
+    'Dish': 423397,
+    'Menu': 17545,
+    'MenuPage': 66937,
+    'MenuItem': 1332726,
+}
+# (lower, upper) bounds checked by the number/year test classes, the check for
+# column c is the test method test_c
+RANGES = {
+    'Dish': {
+        'first_appeared': (1500, 2025),
+        'last_appeared': (1500, 2025),
+        'lowest_price': (0, None),
+        'highest_price': (0, None),
+    },
+    'Menu': {
+        'page_count': (0, None),
+        'dish_count': (0, None),
+    },
+    'MenuPage': {
+        'page_number': (0, None),
+        'full_height': (0, None),
+        'full_width': (0, None),
+    },
+    'MenuItem': {
+        'price': (0, None),
+        'high_price': (0, None),
+        'xpos': (0, 1),
+        'ypos': (0, 1),
+    },
+}
+
+
+class FrameTables:
+    # Lazily loads only the columns the checks ask for, through the parquet cache
+    def __init__(self, path):
+        self.path = path
+        self.frames = {}
+
+    def get(self, table, *columns):
+        key = (table, columns)
+        if key not in self.frames:
+            self.frames[key] = read_table(os.path.join(self.path, f'{table}.csv'), columns=['id', *columns])
+        return self.frames[key]
+
+
+def _ids(df, mask):
+    # Sorted unique ids of the rows flagged by mask, missing comparisons count as not flagged
+    return np.unique(df['id'][mask.fillna(False).to_numpy(dtype=bool)].to_numpy(dtype=np.int64))
+
+
+def check_range(table, column):
+    lower, upper = RANGES[table][column]
+    def check(tables):
+        df = tables.get(table, column)
+        mask = df[column] < lower
+        if upper is not None:
+            mask |= df[column] > upper
+        return _ids(df, mask)
+    return check
+
+
+def check_row_count(table):
+    def check(tables):
+        rows = len(tables.get(table))
+        # no ids for a count mismatch, only the assertion fails
+        return np.empty(0, dtype=np.int64), rows == EXPECTED_ROWS[table]
+    return check
+
+
+def check_fk(table, column, ref_table):
+    def check(tables):
+        df = tables.get(table, column)
+        ref_ids = sorted_ids(tables.get(ref_table)['id'])
+        # outer join semantics: NULL keys do not match anything either
+        return _ids(df, pd.Series(~semi_join(df[column], ref_ids)))
+    return check
+
+
+def check_high_price(tables):
+    df = tables.get('MenuItem', 'price', 'high_price')
+    return _ids(df, df['high_price'] < df['price'])
+
+
+def check_create_update(tables):
+    df = tables.get('MenuItem', 'created_at', 'updated_at')
+    return _ids(df, parse_timestamps(df['created_at']) > parse_timestamps(df['updated_at']))
+
+
+def check_uuid(tables):
+    df = tables.get('MenuPage', 'uuid')
+    return _ids(df, df['uuid'].duplicated(keep=False) & df['uuid'].notna())
+
+
+def check_menu_id_page_number(tables):
+    df = tables.get('MenuPage', 'menu_id', 'page_number')
+    keys = df[['menu_id', 'page_number']]
+    return _ids(df, keys.duplicated(keep=False) & keys.notna().all(axis=1))
+
+
+def check_date_parseable(tables):
+    # '%Y-%m-%d' dates, the way MySQL's STR_TO_DATE reads the dump's values. The SQL
+    # TestMenuDateValid only runs on MySQL, so only there can the two be compared
+    df = tables.get('Menu', 'date')
+    return _ids(df, full_date_years(df['date']).isna())
+
+
+def check_date_valid(tables):
+    df = tables.get('Menu', 'date')
+    return _ids(df, full_date_years(df['date']) > 2025)
+
+
+def _range_checks(table, *columns):
+    return {f'test_{col}': check_range(table, col) for col in columns}
+
+# Mirrors TEST_GROUPS: group -> test class -> test method -> check
+FRAME_GROUPS = {
+    'schema': {
+        'TestTablesSchema': {
+            'test_dish': check_row_count('Dish'),
+            'test_menu': check_row_count('Menu'),
+            'test_menu_item': check_row_count('MenuItem'),
+            'test_menu_item_dish_id_fk': check_fk('MenuItem', 'dish_id', 'Dish'),
+            'test_menu_item_menu_page_id_fk': check_fk('MenuItem', 'menu_page_id', 'MenuPage'),
+            'test_menu_page': check_row_count('MenuPage'),
+            'test_menu_page_menu_id_fk': check_fk('MenuPage', 'menu_id', 'Menu'),
+        },
+    },
+    'dish': {
+        'TestDishYearValid': _range_checks('Dish', 'first_appeared', 'last_appeared'),
+        'TestDisPriceValid': _range_checks('Dish', 'highest_price', 'lowest_price'),
+    },
+    'menu': {
+        'TestMenuNumberValid': _range_checks('Menu', 'dish_count', 'page_count'),
+        'TestMenuDateValid': {
+            'test_date_parseable': check_date_parseable,
+            'test_date_valid': check_date_valid,
+        },
+    },
+    'menupage': {
+        'TestMenuPageNumberValid': _range_checks('MenuPage', 'full_height', 'full_width', 'page_number'),
+        'TestMenuPageDuplicate': {
+            'test_menu_id_page_number': check_menu_id_page_number,
+            'test_uuid': check_uuid,
+        },
+    },
+    'menuitem': {
+        'TestMenuItemNumberValid': {
+            **_range_checks('MenuItem', 'high_price', 'price'),
+            'test_price_high_price': check_high_price,
+            **_range_checks('MenuItem', 'xpos', 'ypos'),
+        },
+        'TestMenuItemDateValid': {
+            'test_create_update': check_create_update,
+        },
+    },
+}
+
+
+def run_class(tables, class_name, checks, output_dir='.', logger=None):
+    # Run one test class worth of checks and write its {TestClass}_FailedID.json,
+    # methods run in name order like unittest does
+    failed_ids = {}
+    results = {}
+    for method in sorted(checks):
+        res = checks[method](tables)
+        ids, passed = res if isinstance(res, tuple) else (res, len(res) == 0)
+        failed_ids[method] = ids.tolist()
+        results[method] = passed
+        if logger:
+            logger.info(f'{class_name}.{method}: {"PASS" if passed else "FAIL"} ({len(ids)} failed ids)')
+    with open(os.path.join(output_dir, f'{class_name}_FailedID.json'), 'w+') as f:
+        json.dump(failed_ids, f)
+    return results
+
+
+def get_parser():
+    # Set up command-line argument parsing
+    parser = argparse.ArgumentParser(description='options for validating csv files without a database')
+    parser.add_argument(
+        '-p', '--path',
+        help='path to the dataset folder',
+        type=str,
+        default='../data/NYPL-menus',  # Default dataset path
+    )
+    parser.add_argument(
+        '-o', '--outdir',
+        help='path to the output directory',
+        type=str,
+        default='.',
+    )
+    parser.add_argument(
+        '--tests',
+        nargs='*',
+        metavar='TEST',
+        help=f'Specify which test groups to run, options: {['all']+list(FRAME_GROUPS.keys())}',
+        default=['all'],
+    )
+    return parser
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    print('Configs =', args)
+
+    # make output folder
+    os.makedirs(args.outdir, exist_ok=True)
+    assert os.path.isdir(args.outdir), f'output path does not exist or is not directory: {args.outdir}'
+    logger = get_logger(os.path.join(args.outdir, 'validate.log'))
+
+    groups = FRAME_GROUPS.keys() if 'all' in args.tests else args.tests
+    tables = FrameTables(args.path)
+    startTime = time.perf_counter()
+    results = {}
+    for group in groups:
+        for class_name, checks in FRAME_GROUPS.get(group, {}).items():
+            results.update(run_class(tables, class_name, checks, args.outdir, logger))
+    timeTaken = time.perf_counter() - startTime
+
+    success_count = sum(results.values())
+    logger.info('='*70, extra={'simple': True})
+    logger.info(f'Checks run: {len(results)}')
+    logger.info(f'Success: {success_count}')
+    logger.info(f'Failure: {len(results) - success_count}')
+    logger.info(f'Total Runtime: {timeTaken:.4f}s')